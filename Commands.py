@@ -1,22 +1,77 @@
 import sublime
 import sublime_plugin
 
-from EntitySelect import EntitySelector, DocLink, Highlight, PreemptiveHighlight
+from EntitySelect import (EntitySelector, DocLink, Highlight,
+                          PreemptiveHighlight, CoalescingScheduler,
+                          SETTINGS_FILE, TEXT_CHANGE_SUPPORT, get_setting,
+                          shutdown_worker_pools)
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel('DEBUG')
 
 
+POPUP_STYLE_SETTINGS_KEY = 'entity_select_popup_styles'
+
+PROFILING_SETTINGS_KEY = 'entity_select_profiling'
+
+
+def plugin_loaded():
+    preferences = sublime.load_settings('Preferences.sublime-settings')
+    DocLink.PopupColorScheme = preferences.get('color_scheme')
+    preferences.add_on_change(POPUP_STYLE_SETTINGS_KEY,
+                              DocLink.color_scheme_changed)
+
+    EntitySelector.update_profiling()
+    sublime.load_settings(SETTINGS_FILE).add_on_change(
+        PROFILING_SETTINGS_KEY, EntitySelector.update_profiling)
+
+
+def plugin_unloaded():
+    sublime.load_settings('Preferences.sublime-settings').clear_on_change(
+        POPUP_STYLE_SETTINGS_KEY)
+    sublime.load_settings(SETTINGS_FILE).clear_on_change(
+        PROFILING_SETTINGS_KEY)
+    shutdown_worker_pools()
+
+
 class EntitySelectListenerCommand(sublime_plugin.EventListener):
 
+    def __init__(self):
+        super(EntitySelectListenerCommand, self).__init__()
+        self.scheduler = CoalescingScheduler(EntitySelector.match_entity)
+
     def on_selection_modified_async(self, view):
         # logger.debug('Running on_modified')
-        EntitySelector.match_entity(view)
+        self.scheduler.quiet_period = get_setting(
+            'selection_quiet_period', self.scheduler.quiet_period)
+        self.scheduler.max_latency = get_setting(
+            'selection_max_latency', self.scheduler.max_latency)
+        self.scheduler.schedule(view)
 
     def on_activated_async(self, view):
         # logger.debug('Running on_activated')
+        DocLink.PendingNavigations.view_activated(view)
         EntitySelector.match_entity(view)
+        EntitySelector.view_activated(view)
+
+    def on_load_async(self, view):
+        DocLink.PendingNavigations.view_loaded(view)
+
+    def on_modified(self, view):
+        EntitySelector.update_change_count(view)
+
+    def on_close(self, view):
+        self.scheduler.cancel(view.id())
+        DocLink.PendingNavigations.cancel(view.id())
+        EntitySelector.release_view(view.id())
+        # The view's window may be closing, so check once it has gone
+        sublime.set_timeout_async(Highlight.release_closed_project_indexes,
+                                  0)
+
+    def on_post_save_async(self, view):
+        Highlight.update_project_indexes(view.file_name())
+        DocLink.update_definition_indexes(view.file_name())
 
 
 class DocLinkCommand(sublime_plugin.TextCommand):
@@ -27,11 +82,17 @@ class DocLinkCommand(sublime_plugin.TextCommand):
     """
 
     def run(self, edit):
-        """Calls the show method of the DocFinder assigned to the view."""
+        """Calls the show method of the DocFinder assigned to the view.
+
+        If the documentation is being prefetched, the show method is called
+        once the prefetch has finished, so it does not wait for it.
+
+        """
         try:
             s = EntitySelector.get_selector_for_view(self.view)
             if s.enable_doc_link():
-                s.show_doc()
+                s.after_prefetch(
+                    lambda: s.profile_call('show_doc', s.show_doc))
         except AttributeError:
             pass
 
@@ -118,13 +179,16 @@ class EntityselectHighlightCommand(sublime_plugin.TextCommand):
 
     """
 
-    def run(self, edit, cmd):
+    def run(self, edit, cmd, scope=Highlight.VIEW_SCOPE):
         """Calls the show method of the DocFinder assigned to the view."""
         if cmd == Highlight.HIGHLIGHT_COMMAND:
             try:
                 s = EntitySelector.get_selector_for_view(self.view)
                 if s.enable_highlight():
                     s.highlight()
+                    if ((scope == Highlight.PROJECT_SCOPE) and
+                            s.enable_project_highlight()):
+                        self.show_project(s)
             except AttributeError:
                 pass
         else:
@@ -140,13 +204,16 @@ class EntityselectHighlightCommand(sublime_plugin.TextCommand):
             elif cmd == Highlight.SELECT_ALL_COMMAND:
                 hl.select_all_highlights()
             elif cmd == Highlight.SHOW_ALL_COMMAND:
-                self.show_all(hl)
+                if scope == Highlight.PROJECT_SCOPE:
+                    self.show_project(hl)
+                else:
+                    self.show_all(hl)
 
-    def description(self, cmd):
+    def description(self, cmd, scope=Highlight.VIEW_SCOPE):
         """Returns the description for the DocFinder assigned to the view."""
         if cmd == Highlight.HIGHLIGHT_COMMAND:
             try:
-                return EntitySelector.get_selector_for_view(
+                description = EntitySelector.get_selector_for_view(
                     self.view).highlight_description(cmd)
             except AttributeError:
                 return 'Highlight'
@@ -154,9 +221,13 @@ class EntityselectHighlightCommand(sublime_plugin.TextCommand):
             hl = Highlight.get_highlighter_for_view(self.view)
             if hl is None:
                 return 'Highlight'
-            return hl.highlight_description(cmd)
+            description = hl.highlight_description(cmd)
+
+        if scope == Highlight.PROJECT_SCOPE:
+            description += ' in project'
+        return description
 
-    def is_visible(self, cmd):
+    def is_visible(self, cmd, scope=Highlight.VIEW_SCOPE):
         """Returns true if the current file is an M-AT file."""
         if cmd == Highlight.HIGHLIGHT_COMMAND:
             try:
@@ -172,30 +243,96 @@ class EntityselectHighlightCommand(sublime_plugin.TextCommand):
         else:
             return True
 
-    def is_enabled(self, cmd):
+    def is_enabled(self, cmd, scope=Highlight.VIEW_SCOPE):
         """Returns True if a Highlighter is assigned to the view."""
         if cmd == Highlight.HIGHLIGHT_COMMAND:
+            hl = EntitySelector.get_selector_for_view(self.view)
             try:
-                return EntitySelector.get_selector_for_view(
-                    self.view).enable_highlight()
+                if not hl.enable_highlight():
+                    return False
             except AttributeError:
                 return False
-        elif Highlight.get_highlighter_for_view(self.view) is None:
-            return False
         else:
-            return True
+            hl = Highlight.get_highlighter_for_view(self.view)
+            if hl is None:
+                return False
+
+        if scope == Highlight.PROJECT_SCOPE:
+            return hl.enable_project_highlight()
+        return True
+
+    def show_project(self, highlighter):
+        """Show the occurrences of the entity in the project in a quick
+        panel.
+
+        """
+        window = self.view.window()
+
+        def show(items):
+            if not items:
+                sublime.status_message('No occurrences found in project')
+                return
+
+            def on_done(index, flags=sublime.ENCODED_POSITION):
+                if index != -1:
+                    window.open_file(items[index][1], flags)
+
+            window.show_quick_panel(
+                [i[0] for i in items], on_done, 0, 0,
+                lambda index: on_done(
+                    index, sublime.ENCODED_POSITION | sublime.TRANSIENT))
+
+        highlighter.find_project_occurrences(show)
+
+    def show_all(self, highlighter, count=None, selected=0,
+                 curr_sel=None, curr_vp=None):
+        """Show the highlighted regions in a quick panel.
+
+        If the view is still being scanned, the panel is opened on the main
+        thread once the scan has finished. Only the first count regions are
+        listed. If there are more, the last item of the panel reopens it
+        with the next batch added.
+
+        """
+        if highlighter.highlight_in_progress():
+            sublime.status_message('Scanning for highlights...')
+        highlighter.when_highlight_complete(
+            lambda: sublime.set_timeout(
+                lambda: self.show_all_panel(highlighter, count, selected,
+                                            curr_sel, curr_vp), 0))
+
+    def show_all_panel(self, highlighter, count, selected, curr_sel,
+                       curr_vp):
+        """Open the Show All quick panel for a fully scanned view."""
+        items = list(highlighter.highlight_regions)
+        batch_size = get_setting('show_all_batch_size', 1000)
+        if count is None:
+            count = batch_size
+        disp_items = highlighter.get_display_regions(items[:count])
+        if len(items) > count:
+            disp_items.append('... %s more' % (len(items) - count))
+
+        if curr_sel is None:
+            curr_sel = [s for s in self.view.sel()]
+            curr_vp = self.view.viewport_position()
+
+        def on_done(index):
+            if index == count and len(items) > count:
+                sublime.set_timeout(
+                    lambda: self.show_all(highlighter, count + batch_size,
+                                          count, curr_sel, curr_vp), 0)
+            else:
+                self.show_error(index, items, curr_sel, curr_vp)
+
+        def on_highlight(index):
+            if index < count:
+                self.show_error(index, items, curr_sel, curr_vp)
 
-    def show_all(self, highlighter):
-        items = highlighter.highlight_regions
-        disp_items = [highlighter.get_display_region(r) for r in items]
-        curr_sel = [s for s in self.view.sel()]
-        curr_vp = self.view.viewport_position()
-        func = lambda x: self.show_error(x, items, curr_sel, curr_vp)
         self.view.window().show_quick_panel(disp_items,
-                                            func,
-                                            0,
+                                            on_done,
                                             0,
-                                            func)
+                                            selected,
+                                            on_highlight)
 
     def show_error(self, index, items, curr_sel, curr_vp):
         if index == -1:
@@ -220,49 +357,16 @@ class PreemptiveHighlightCommand(sublime_plugin.TextCommand):
         """Calls the show method of the DocFinder assigned to the view."""
         c = PreemptiveHighlight.get_preemptive_highlighter(highlighter)
         if c is not None:
-            ps = c.get_preemptive_highlight_selection(self.view)
-            if not ps:
-                sublime.status_message('No regions to highlight')
-                return
-
-            # Copy current selection, then replace with preemptive selection
-            current_selection = self.copy_current_selection()
-            self.view.sel().clear()
-            self.view.sel().add_all(ps)
-
-            # Get current selector
-            current_selector = EntitySelector.get_selector_for_view(self.view)
-
-            # Determine if the highlighter should be enabled
-            enabled = c.enable_for_selection(self.view)
-            if not enabled:
+            if c.preemptive_highlight(self.view,
+                                      on_done=self.highlight_done) is None:
                 sublime.status_message('No regions to highlight')
-                self.view.sel().clear()
-                self.view.sel().add_all(current_selection)
-                return
-
-            # Create the highlighter and highlight
-            preemptive_highlighter = c(self.view, **enabled)
-            preemptive_highlighter.highlight()
-
-            # Restore the current selection
-            self.view.sel().clear()
-            self.view.sel().add_all(current_selection)
-
-            # If there were no highlighted regions, remove the highlight
-            if not preemptive_highlighter.highlight_regions:
-                sublime.status_message('No regions to highlight')
-                preemptive_highlighter.remove_highlighter_from_view()
-
-            # Restore the current selector
-            if current_selector is None:
-                EntitySelector.update_selector_for_view(self.view, None)
-            else:
-                current_selector.__class__.update_selector_for_view(
-                    self.view, current_selector)
 
-    def copy_current_selection(self):
-        return [r for r in self.view.sel()]
+    def highlight_done(self, highlighter):
+        # If there were no highlighted regions, remove the highlight
+        if not (highlighter.highlight_regions or
+                highlighter.highlight_in_progress()):
+            sublime.status_message('No regions to highlight')
+            highlighter.remove_highlighter_from_view()
 
     def is_visible(self, highlighter):
         """Returns true if the current file is an M-AT file."""
@@ -290,14 +394,135 @@ class HighlightListenerCommand(sublime_plugin.EventListener):
             return
         hl = Highlight.get_highlighter_for_view(view)
         if hl is not None:
-            hl.highlight()
-            if not hl.highlight_regions:
+            hl.update_highlight()
+            if not (hl.highlight_regions or hl.highlight_in_progress()):
                 hl.remove_highlighter_from_view()
         else:
             view.erase_regions('entity_select_highlight')
 
 
+if TEXT_CHANGE_SUPPORT:
+    class HighlightTextChangeListener(sublime_plugin.TextChangeListener):
+        """Records buffer edits so highlights and buffer snapshots can be
+        updated incrementally.
+
+        """
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            return True
+
+        def on_text_changed(self, changes):
+            views = self.buffer.views()
+            if not views:
+                return
+            change_count = views[0].change_count()
+            texts = [(c.a.pt, c.b.pt, c.str) for c in changes]
+            for v in views:
+                EntitySelector.record_text_changes(v, change_count, texts)
+
+            highlighters = [Highlight.get_highlighter_for_view(v)
+                            for v in views]
+            highlighters = [hl for hl in highlighters if hl is not None]
+            if not highlighters:
+                return
+
+            edits = [(begin, end, len(text)) for begin, end, text in texts]
+            for hl in highlighters:
+                hl.record_text_changes(change_count, edits)
+
+
+class EntitySelectDebugStatsCommand(sublime_plugin.WindowCommand):
+    """Shows how much per-view state is currently retained."""
+
+    PANEL_NAME = 'entity_select_stats'
+
+    def run(self):
+        with EntitySelector.ViewSelectorsLock:
+            view_data = list(EntitySelector.ViewSelectors.values())
+        highlighters = [hl for hl in Highlight.Highlighters.values()
+                        if hl is not None]
+        view_data_size = sum(vd.estimated_size() for vd in view_data)
+        highlighter_size = sum(hl.estimated_size() for hl in highlighters)
+        highlight_count = sum(len(hl.highlight_regions)
+                              for hl in highlighters)
+
+        lines = [
+            'View data entries: %s (%s)' % (
+                len(view_data), self.format_size(view_data_size)),
+            'Highlighter entries: %s, %s assigned (%s)' % (
+                len(Highlight.Highlighters), len(highlighters),
+                self.format_size(highlighter_size)),
+            'Highlighted regions: %s' % highlight_count,
+            'Max tracked views: %s' % get_setting('max_tracked_views', 100),
+        ]
+        for cls, cache in sorted(DocLink.DocCaches.items(),
+                                 key=lambda i: i[0].__name__):
+            lines.append('Doc cache %s: %s/%s entries, %s hits, %s misses' % (
+                cls.__name__, len(cache), cache.max_size, cache.hits,
+                cache.misses))
+
+        panel = self.window.create_output_panel(self.PANEL_NAME)
+        panel.set_read_only(False)
+        panel.run_command('entity_select_insert_in_view',
+                          {'text': '\n'.join(lines) + '\n'})
+        panel.set_read_only(True)
+        self.window.run_command('show_panel',
+                                {'panel': 'output.' + self.PANEL_NAME})
+
+    @staticmethod
+    def format_size(size):
+        return '%.1f KiB' % (size / 1024)
+
+
+class EntitySelectProfileCommand(sublime_plugin.WindowCommand):
+    """Shows the time spent in each selector class since the last report.
+
+    Timings are only recorded while the profile_selectors setting is true.
+    The recorded timings are discarded once shown.
+
+    """
+
+    PANEL_NAME = 'entity_select_profile'
+
+    COLUMNS = '%-32s %-56s %8s %10s %9s %9s %9s %9s'
+
+    def run(self):
+        items = EntitySelector.SelectorTimings.take()
+        if items:
+            lines = [self.COLUMNS % ('Class', 'Operation', 'Calls',
+                                     'Total ms', 'p50 ms', 'p90 ms',
+                                     'p99 ms', 'Max ms')]
+            for (class_name, operation), timing in items:
+                lines.append(self.COLUMNS % (
+                    class_name, operation, timing.count,
+                    self.format_ms(timing.total),
+                    self.format_ms(timing.percentile(0.5)),
+                    self.format_ms(timing.percentile(0.9)),
+                    self.format_ms(timing.percentile(0.99)),
+                    self.format_ms(timing.maximum)))
+        elif EntitySelector.ProfileSelectors:
+            lines = ['No selector calls recorded since the last report.']
+        else:
+            lines = ['Selector profiling is disabled. Set profile_selectors'
+                     ' to true in %s to enable it.' % SETTINGS_FILE]
+
+        panel = self.window.create_output_panel(self.PANEL_NAME)
+        panel.set_read_only(False)
+        panel.run_command('entity_select_insert_in_view',
+                          {'text': '\n'.join(lines) + '\n'})
+        panel.set_read_only(True)
+        self.window.run_command('show_panel',
+                                {'panel': 'output.' + self.PANEL_NAME})
+
+    @staticmethod
+    def format_ms(duration):
+        return '%.2f' % (duration * 1000)
+
+
 class EntitySelectInsertInViewCommand(sublime_plugin.TextCommand):
 
-    def run(self, edit, text, point=0):
+    def run(self, edit, text, point=0, clear=False):
+        if clear:
+            self.view.erase(edit, sublime.Region(0, self.view.size()))
         self.view.insert(edit, point, text)
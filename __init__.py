@@ -1,15 +1,30 @@
+import bisect
+import hashlib
 import inspect
 import os
+import re
+import sys
+import threading
 import time
 import webbrowser
 
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from operator import itemgetter
+
 import logging
 logger = logging.getLogger(__name__)
 
 import sublime
+import sublime_plugin
 
 TOOLTIP_SUPPORT = int(sublime.version()) >= 3072
 
+TEXT_CHANGE_SUPPORT = hasattr(sublime_plugin, 'TextChangeListener')
+
+SETTINGS_FILE = 'EntitySelect.sublime-settings'
+
 try:
     if TOOLTIP_SUPPORT:
         import styled_popup
@@ -20,19 +35,95 @@ except ImportError:
         'StyledPopup is not available. Some features will be unavailable.'
         ' Run "Package Control: Satisfy Dependencies" to install it.')
 
-from .src.SortableABCMeta import SortableABCMeta, abstractmethod
+from .src.CoalescingScheduler import CoalescingScheduler
+from .src.RegionIndex import RegionIndex
+from .src.ScopeIndex import ScopeIndex
+from .src.TimingStats import TimingStats
+from .src.WorkerPool import WorkerPool
+from .src.BufferSnapshot import BufferSnapshot
+from .src.ProjectIndex import ProjectIndex
+from .src.DefinitionIndex import DefinitionIndex
+from .src.LRUCache import LRUCache
+from .src.NavigationRegistry import NavigationRegistry
+from .src.PrefetchTask import PrefetchTask
+
+
+def get_setting(key, default=None):
+    """Returns the value of an EntitySelect setting."""
+    return sublime.load_settings(SETTINGS_FILE).get(key, default)
+
+
+# Dictionary of the WorkerPools used by EntitySelect, keyed by name. Each
+# pool is created when first needed by worker_pool.
+WorkerPools = dict()
+WorkerPoolsLock = threading.Lock()
+
+
+def worker_pool(name, threads_setting=None, threads=1):
+    """Returns the WorkerPool with the given name, creating it if needed.
+
+    A new pool has the number of worker threads given by the threads_setting
+    setting if there is one, or threads.
+
+    """
+    with WorkerPoolsLock:
+        pool = WorkerPools.get(name)
+        if pool is None:
+            if threads_setting is not None:
+                threads = get_setting(threads_setting, threads)
+            pool = WorkerPools[name] = WorkerPool(threads, name=name)
+        return pool
+
+
+def cancel_worker_job(name, key):
+    """Cancels the job submitted with key to the WorkerPool with the given
+    name, if the pool has been created.
+
+    """
+    pool = WorkerPools.get(name)
+    if pool is not None:
+        pool.cancel(key)
+
+
+def shutdown_worker_pools():
+    """Shuts down all the WorkerPools created so far."""
+    with WorkerPoolsLock:
+        pools = list(WorkerPools.values())
+        WorkerPools.clear()
+    for pool in pools:
+        pool.shutdown()
 
 
-class EntitySelector(object, metaclass=SortableABCMeta):
+class EntitySelector(object, metaclass=ABCMeta):
     """General purpose superclass for matching portions of text."""
 
     # Dictionary used to store data about a view. The dictionary is keyed by
-    # the view ID and contains ViewData objects.
-    ViewSelectors = dict()
+    # the view ID and contains ViewData objects, ordered from the least to
+    # the most recently activated view.
+    ViewSelectors = OrderedDict()
+
+    # Guards ViewSelectors, which is read and changed from both the main and
+    # the async thread.
+    ViewSelectorsLock = threading.RLock()
+
+    # A list of callbacks to be run when the data stored for a view is
+    # released, because the view was closed or evicted. Callbacks are called
+    # with the ID of the view.
+    OnViewReleasedCallbacks = []
 
     # A list of all possible EntitySelector classes to check
     PossibleSelectors = []
 
+    # Version of the PossibleSelectors list. This is incremented whenever
+    # selectors are added or removed, so ViewData objects can tell when their
+    # possible selectors need to be recomputed.
+    RegistryVersion = 0
+
+    # Number of open registry batches, and whether the registry changed while
+    # a batch was open.
+    _RegistryBatchDepth = 0
+    _RegistryBatchChanged = False
+
     # A list of callbacks to be run before the selection checks are run.
     # Callbacks are called with the following arguments:
     #   cls - If the view has a current EntitySelector, this will be the class
@@ -51,6 +142,21 @@ class EntitySelector(object, metaclass=SortableABCMeta):
     #   view - The given view
     OnAfterCheckCallbacks = []
 
+    # Dictionary of resolved check callbacks. The dictionary is keyed by
+    # (class, callback list attribute) and contains tuples of
+    # (callback, callback name). It is cleared whenever a callback is added.
+    CheckCallbackCache = dict()
+
+    # Check callbacks taking longer than this many seconds are logged.
+    SlowCallbackThreshold = 0.05
+
+    # Set by the profile_selectors setting. While True, the durations of
+    # selector methods and check callbacks are recorded in SelectorTimings.
+    ProfileSelectors = False
+
+    # Durations recorded while profiling, keyed by (class name, operation).
+    SelectorTimings = TimingStats()
+
     @classmethod
     @abstractmethod
     def scope_view_enabler(cls):
@@ -92,14 +198,16 @@ class EntitySelector(object, metaclass=SortableABCMeta):
             checked. Otherwise, only the first selection is checked.
 
         """
+        vd = EntitySelector.get_view_data(view)
         if check_all_regions:
-            return [view.score_selector(s.begin(),
-                                        cls.scope_selection_enabler())
-                    for s in view.sel()]
+            points = [s.begin() for s in view.sel()]
+            scopes = vd.scope_names_at(view, points)
+            selector = cls.scope_selection_enabler()
+            return [vd.score_scope(scopes[p], selector) for p in points]
         else:
             try:
-                return [view.score_selector(view.sel()[0].begin(),
-                                            cls.scope_selection_enabler())]
+                return [vd.score_selection_scope(view, cls,
+                                                 view.sel()[0].begin())]
             except KeyError:
                 return []
 
@@ -123,6 +231,18 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         cls(view)
         return True
 
+    @classmethod
+    def enable_for_region(cls, view, region):
+        """Returns the keyword arguments used to create the EntitySelector for
+        the given region, or a false value if it should not be enabled.
+
+        Unlike enable_for_selection, this does not read the view's selection,
+        so it can be used for regions other than the selection. By default,
+        the region is used as the search region.
+
+        """
+        return {'search_region': region}
+
     @classmethod
     def update_selector_for_view(cls, view, selector = None):
         """Updates the EntitySelector assigned to the specified view.
@@ -131,12 +251,58 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         specified selector is assigned.
 
         """
-        try:
-            vd = EntitySelector.ViewSelectors[view.id()]
-        except KeyError:
-            EntitySelector.ViewSelectors[view.id()] = ViewData(view, selector)
-        else:
-            vd.selector = selector
+        vd = EntitySelector.lookup_view_data(view.id())
+        if vd is None:
+            vd = ViewData(view, selector)
+            with EntitySelector.ViewSelectorsLock:
+                vd = EntitySelector.ViewSelectors.setdefault(view.id(), vd)
+        vd.selector = selector
+
+    @classmethod
+    def get_view_data(cls, view):
+        """Returns the ViewData object for the given view.
+
+        If no ViewData object exists for the view, one is created.
+
+        """
+        vd = EntitySelector.lookup_view_data(view.id())
+        if vd is None:
+            vd = ViewData(view)
+            with EntitySelector.ViewSelectorsLock:
+                vd = EntitySelector.ViewSelectors.setdefault(view.id(), vd)
+        return vd
+
+    @staticmethod
+    def lookup_view_data(view_id):
+        """Returns the ViewData object for a view ID, or None."""
+        with EntitySelector.ViewSelectorsLock:
+            return EntitySelector.ViewSelectors.get(view_id)
+
+    @classmethod
+    def update_change_count(cls, view):
+        """Records a change to the view's buffer.
+
+        This invalidates the cached scopes for the view.
+
+        """
+        vd = EntitySelector.lookup_view_data(view.id())
+        if vd is not None:
+            vd.update_change_count(view)
+
+    @classmethod
+    def record_text_changes(cls, view, change_count, changes):
+        """Records changes to the view's buffer, so its buffer snapshot can
+        be patched rather than copied from the view again.
+
+        Keyword arguments:
+        change_count - the change count of the buffer after the changes
+        changes - a list of (begin, end, text) tuples, one for each change,
+            meaning the text from begin to end was replaced by text
+
+        """
+        vd = EntitySelector.lookup_view_data(view.id())
+        if vd is not None:
+            vd.record_text_changes(change_count, changes)
 
     @classmethod
     def get_selector_for_view(cls, view):
@@ -145,34 +311,124 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         If no selector is assigned, None is returned.
 
         """
-        try:
-            return EntitySelector.ViewSelectors[view.id()].selector
-        except KeyError:
-            return None
+        vd = EntitySelector.lookup_view_data(view.id())
+        return None if vd is None else vd.selector
+
+    @staticmethod
+    def add_on_view_released_callback(callback):
+        """Adds a callback to be run when the data for a view is released."""
+        EntitySelector.OnViewReleasedCallbacks.append(callback)
+
+    @classmethod
+    def release_view(cls, view_id):
+        """Frees the data stored for a view.
+
+        This is called when a view is closed, and when an inactive view is
+        evicted. The view itself may no longer be valid. The selector's
+        clear_view is called, so an evicted view does not keep showing a
+        selector that no longer exists; the on_before_check callbacks are
+        not run.
+
+        """
+        with EntitySelector.ViewSelectorsLock:
+            vd = EntitySelector.ViewSelectors.pop(view_id, None)
+        if (vd is not None) and (vd.selector is not None):
+            try:
+                vd.selector.clear_view()
+            except Exception:
+                logger.exception('Error occurred clearing view %s', view_id)
+        for callback in EntitySelector.OnViewReleasedCallbacks:
+            try:
+                callback(view_id)
+            except Exception:
+                logger.exception('Error occurred releasing view %s', view_id)
+
+    @classmethod
+    def view_activated(cls, view):
+        """Marks the view as the most recently used view.
+
+        The data of the least recently used views is then evicted so that no
+        more than the max_tracked_views setting are kept.
+
+        """
+        with EntitySelector.ViewSelectorsLock:
+            try:
+                EntitySelector.ViewSelectors.move_to_end(view.id())
+            except KeyError:
+                pass
+        cls.evict_inactive_views(get_setting('max_tracked_views', 100))
+
+    @classmethod
+    def evict_inactive_views(cls, max_views):
+        """Releases the least recently used views beyond max_views.
+
+        Views currently visible in a window are never evicted. Returns the
+        IDs of the evicted views.
+
+        """
+        with EntitySelector.ViewSelectorsLock:
+            view_ids = list(EntitySelector.ViewSelectors)
+        excess = len(view_ids) - max_views
+        if excess <= 0:
+            return []
+
+        visible = EntitySelector.visible_view_ids()
+        evicted = [i for i in view_ids if i not in visible][:excess]
+        for view_id in evicted:
+            cls.release_view(view_id)
+        return evicted
+
+    @staticmethod
+    def visible_view_ids():
+        """Returns a set of the IDs of the views visible in any window."""
+        visible = set()
+        for window in sublime.windows():
+            for group in range(window.num_groups()):
+                view = window.active_view_in_group(group)
+                if view is not None:
+                    visible.add(view.id())
+        return visible
 
     @classmethod
     def get_possible_selectors_for_view(cls, view):
         """Returns a list of the possible selectors for a view."""
-        try:
-            vd = EntitySelector.ViewSelectors[view.id()]
-            return EntitySelector.ViewSelectors[view.id()].get_possible_selectors_for_view(view)
-        except KeyError:
+        vd = EntitySelector.lookup_view_data(view.id())
+        if vd is None:
             return []
+        return vd.get_possible_selectors_for_view(view)
 
     @classmethod
     def sorted_selectors_for_selection(cls, view):
         """Returns a sorted list of EntitySelector classes that match the current scope.
 
-        The list is sorted in descending order of score.
+        Only the candidates returned by the view's ScopeIndex for the scope
+        at the first selection are scored. The list is sorted in descending
+        order of score.
 
         """
+        vd = EntitySelector.get_view_data(view)
+        if not vd.get_possible_selectors_for_view(view):
+            return []
+
+        scope = vd.scope_name(view, view.sel()[0].begin())
         selectors = []
-        for c in cls.get_possible_selectors_for_view(view):
+        for c in vd.candidate_selectors(scope):
             score = c.check_scope_for_selection(view)[0]
             if score > 0:
                 selectors.append((score, c))
 
-        selectors.sort(reverse = True)
+        return EntitySelector.rank_selectors(selectors)
+
+    @staticmethod
+    def rank_selectors(selectors):
+        """Returns the classes from a list of (score, class) tuples in
+        descending order of score.
+
+        The list must be in registration order. Selectors with equal scores
+        keep that order, so the earliest registered selector wins a tie.
+
+        """
+        selectors.sort(key=itemgetter(0), reverse = True)
         return [c for s, c in selectors]
 
     @classmethod
@@ -184,6 +440,7 @@ class EntitySelector(object, metaclass=SortableABCMeta):
             if not hasattr(cls, 'OnBeforeCheckCallbacks'):
                 cls.OnBeforeCheckCallbacks = []
             cls.OnBeforeCheckCallbacks.append(callback)
+        EntitySelector.CheckCallbackCache.clear()
 
     @classmethod
     def add_on_after_check_callback(cls, callback, propagate = False):
@@ -194,70 +451,119 @@ class EntitySelector(object, metaclass=SortableABCMeta):
             if not hasattr(cls, 'OnAfterCheckCallbacks'):
                 cls.OnAfterCheckCallbacks = []
             cls.OnAfterCheckCallbacks.append(callback)
+        EntitySelector.CheckCallbackCache.clear()
 
     @classmethod
     def get_on_before_check_callbacks(cls):
         """Returns a list of on_before_check callbacks."""
-        if cls == EntitySelector:
-            return EntitySelector.OnBeforeCheckCallbacks
-        else:
-            callbacks = []
-            for c in cls.__mro__:
-                try:
-                    callbacks.extend(c.OnBeforeCheckCallbacks)
-                except AttributeError:
-                    pass
-            return callbacks
+        return [c for c, name in
+                cls.resolve_check_callbacks('OnBeforeCheckCallbacks')]
 
     @classmethod
     def get_on_after_check_callbacks(cls):
         """Returns a list of on_after_check callbacks."""
-        if cls == EntitySelector:
-            return EntitySelector.OnAfterCheckCallbacks
-        else:
-            callbacks = []
-            for c in cls.__mro__:
-                try:
-                    callbacks.extend(c.OnAfterCheckCallbacks)
-                except AttributeError:
-                    pass
-            return callbacks
+        return [c for c, name in
+                cls.resolve_check_callbacks('OnAfterCheckCallbacks')]
+
+    @classmethod
+    def resolve_check_callbacks(cls, attribute):
+        """Returns a tuple of (callback, name) pairs for a callback list.
+
+        The callbacks are collected from the callback lists defined on the
+        classes in the method resolution order. The result is cached until
+        another callback is added.
+
+        """
+        key = (cls, attribute)
+        try:
+            return EntitySelector.CheckCallbackCache[key]
+        except KeyError:
+            pass
+
+        callbacks = []
+        for c in cls.__mro__:
+            try:
+                callbacks.extend(vars(c)[attribute])
+            except KeyError:
+                pass
+        resolved = tuple((c, EntitySelector.callback_name(c))
+                         for c in callbacks)
+        EntitySelector.CheckCallbackCache[key] = resolved
+        return resolved
+
+    @staticmethod
+    def callback_name(callback):
+        """Returns a descriptive name for a callback."""
+        try:
+            return '{0}.{1}'.format(callback.__module__, callback.__qualname__)
+        except AttributeError:
+            return repr(callback)
 
     @classmethod
     def run_on_before_check_callbacks(cls, view):
         """Calls the on_before_check callbacks."""
         # logger.debug('running on before check callbacks')
-        selector = cls.get_selector_for_view(view)
-        if selector is None:
-            for c in cls.get_on_before_check_callbacks():
-                try:
-                    c(cls = EntitySelector, selector = None, view = view)
-                except Exception:
-                    logger.exception('Error occurred in EntitySelector on_before_check callback')
-        else:
-            for c in cls.get_on_before_check_callbacks():
-                try:
-                    c(cls = selector.__class__, selector = selector, view = view)
-                except Exception:
-                    logger.exception('Error occurred in EntitySelector on_before_check callback')
+        cls.run_check_callbacks(view, 'OnBeforeCheckCallbacks',
+                                'on_before_check')
 
     @classmethod
     def run_on_after_check_callbacks(cls, view):
         """Calls the on_after_check callbacks."""
         # logger.debug('running on after check callbacks')
+        cls.run_check_callbacks(view, 'OnAfterCheckCallbacks',
+                                'on_after_check')
+
+    @classmethod
+    def run_check_callbacks(cls, view, attribute, description):
+        """Calls the check callbacks in the given callback list.
+
+        Callbacks slower than SlowCallbackThreshold are logged by name. While
+        profiling, the duration is also recorded for the selector class.
+
+        """
         selector = cls.get_selector_for_view(view)
         if selector is None:
-            for c in cls.get_on_after_check_callbacks():
-                try:
-                    c(cls = EntitySelector, selector = None, view = view)
-                except Exception:
-                    logger.exception('Error occurred in EntitySelector on_after_check callback')
+            selector_class = EntitySelector
         else:
-            for c in cls.get_on_after_check_callbacks():
-                try:
-                    c(cls = selector.__class__, selector = selector, view = view)
-                except Exception:
-                    logger.exception('Error occurred in EntitySelector on_after_check callback')
+            selector_class = selector.__class__
+
+        for c, name in cls.resolve_check_callbacks(attribute):
+            start = time.perf_counter()
+            try:
+                c(cls = selector_class, selector = selector, view = view)
+            except Exception:
+                logger.exception(
+                    'Error occurred in EntitySelector %s callback %s',
+                    description, name)
+            duration = time.perf_counter() - start
+            if EntitySelector.ProfileSelectors:
+                EntitySelector.SelectorTimings.record(
+                    (selector_class.__name__, name), duration)
+            if duration > EntitySelector.SlowCallbackThreshold:
+                logger.warning('Slow EntitySelector %s callback %s: %.1f ms',
+                               description, name, duration * 1000)
+
+    @staticmethod
+    def update_profiling():
+        """Enables or disables profiling from the profile_selectors setting."""
+        EntitySelector.ProfileSelectors = bool(
+            get_setting('profile_selectors', False))
+
+    @classmethod
+    def profile_call(cls, operation, function, *args, **kwargs):
+        """Calls function, recording its duration as operation of the class.
+
+        The function is called without timing unless profiling is enabled.
+
+        """
+        if not EntitySelector.ProfileSelectors:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            EntitySelector.SelectorTimings.record(
+                (cls.__name__, operation), time.perf_counter() - start)
 
     @classmethod
     def UniqueKey(cls):
@@ -267,6 +573,7 @@ class EntitySelector(object, metaclass=SortableABCMeta):
     def add_possible_selector(cls):
         cls.ADDED_TIME = time.monotonic()
         EntitySelector.PossibleSelectors.append(cls)
+        EntitySelector.registry_changed()
 
     @classmethod
     def remove_possible_selector(cls):
@@ -274,12 +581,73 @@ class EntitySelector(object, metaclass=SortableABCMeta):
             EntitySelector.PossibleSelectors.remove(cls)
         except ValueError:
             pass
+        else:
+            EntitySelector.registry_changed()
+
+    @staticmethod
+    def add_possible_selectors(selectors):
+        """Adds several EntitySelector classes to the possible selectors.
+
+        The registry version is only incremented once for the whole batch.
+
+        """
+        with EntitySelector.registry_batch():
+            for c in selectors:
+                c.add_possible_selector()
+
+    @staticmethod
+    def remove_possible_selectors(selectors):
+        """Removes several EntitySelector classes from the possible selectors.
+
+        The registry version is only incremented once for the whole batch.
+
+        """
+        with EntitySelector.registry_batch():
+            for c in selectors:
+                c.remove_possible_selector()
+
+    @staticmethod
+    @contextmanager
+    def registry_batch():
+        """Context manager that defers registry version updates.
+
+        Any number of selectors can be added or removed within the batch. The
+        registry version is incremented once when the outermost batch closes.
+
+        """
+        EntitySelector._RegistryBatchDepth += 1
+        try:
+            yield
+        finally:
+            EntitySelector._RegistryBatchDepth -= 1
+            if ((EntitySelector._RegistryBatchDepth == 0) and
+                    EntitySelector._RegistryBatchChanged):
+                EntitySelector._RegistryBatchChanged = False
+                EntitySelector.RegistryVersion += 1
+
+    @staticmethod
+    def registry_changed():
+        """Increments the registry version, or defers it until the open
+        registry batch closes.
+
+        """
+        if EntitySelector._RegistryBatchDepth:
+            EntitySelector._RegistryBatchChanged = True
+        else:
+            EntitySelector.RegistryVersion += 1
 
     @classmethod
-    def match_entity(cls, view):
+    def match_entity(cls, view, is_stale=None):
         """Checks the loaded DocFinders. If one is found matching the current
         selection, the word is underlined.
 
+        Keyword arguments:
+        is_stale - An optional function returning True once the selection
+            being evaluated has been superseded. The evaluation is abandoned
+            before the current selector is cleared, or at the next checkpoint
+            before a new selector is created. In the latter case, the
+            on_after_check callbacks still run.
+
         """
         if not cls.PossibleSelectors:
             return
@@ -287,11 +655,16 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         if view.settings().get('is_widget', False):
             return
 
+        cls.get_view_data(view).update_change_count(view)
+
         selector = cls.get_selector_for_view(view)
         if selector is not None:
             if selector.compare_current_selection(view):
                 return
 
+        if (is_stale is not None) and is_stale():
+            return
+
         # Prepare for a new selector
         EntitySelector.update_selector_for_view(view)
         cls.run_on_before_check_callbacks(view)
@@ -300,7 +673,13 @@ class EntitySelector(object, metaclass=SortableABCMeta):
             return
 
         for c in cls.sorted_selectors_for_selection(view):
-            kwargs = c.enable_for_selection(view)
+            if (is_stale is not None) and is_stale():
+                break
+            if EntitySelector.ProfileSelectors:
+                kwargs = c.profile_call('enable_for_selection',
+                                        c.enable_for_selection, view)
+            else:
+                kwargs = c.enable_for_selection(view)
             if kwargs:
                 c(view, **kwargs)
                 break
@@ -317,20 +696,36 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         difference between them for any of the selections, return False.
         Otherwise return True.
 
+        The scopes are resolved in batches of selections which double in
+        size, so a mismatch among the first selections is found without
+        resolving the scopes of all of them.
+
         """
-        for s in view.sel():
-            start_scope = view.scope_name(s.begin()).strip()
-            if view.score_selector(s.end(), start_scope) <= 0:
-                if s.empty():
-                    return False
-                elif view.score_selector(s.end() - 1, start_scope) <= 0:
-                    return False
-            start_scope = start_scope.split(' ')[-1]
-            try:
-                if start_scope != overall_scope:
+        vd = EntitySelector.get_view_data(view)
+        selections = list(view.sel())
+        overall_scope = None
+        start = 0
+        size = 1
+        while start < len(selections):
+            batch = selections[start:start + size]
+            points = [s.begin() for s in batch]
+            points.extend(s.end() for s in batch)
+            scopes = vd.scope_names_at(view, points)
+            for s in batch:
+                start_scope = scopes[s.begin()].strip()
+                if vd.score_scope(scopes[s.end()], start_scope) <= 0:
+                    if s.empty():
+                        return False
+                    elif vd.score_scope(vd.scope_name(view, s.end() - 1),
+                                        start_scope) <= 0:
+                        return False
+                start_scope = start_scope.split(' ')[-1]
+                if overall_scope is None:
+                    overall_scope = start_scope
+                elif start_scope != overall_scope:
                     return False
-            except NameError:
-                overall_scope = start_scope
+            start += size
+            size *= 2
         return True
 
     @abstractmethod
@@ -340,6 +735,34 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         self.regions = view.sel()
         self.__class__.update_selector_for_view(view, self)
 
+    @property
+    def regions(self):
+        """The regions claimed by the selector.
+
+        Assigned lists of regions are stored in a RegionIndex so containment
+        checks stay fast for selectors with many regions. A view's live
+        Selection is stored as is.
+
+        """
+        return self._regions
+
+    @regions.setter
+    def regions(self, value):
+        if isinstance(value, (RegionIndex, sublime.Selection)):
+            self._regions = value
+        else:
+            self._regions = RegionIndex(value)
+
+    def clear_view(self):
+        """Erases the regions and status strings the selector drew in its
+        view.
+
+        This is called when the data stored for the view is released.
+        Subclasses drawing in the view should extend it.
+
+        """
+        pass
+
     def compare_current_selection(self, view, check_all_regions=False):
         """
         Returns True if the current view selection matches the selections
@@ -356,11 +779,9 @@ class EntitySelector(object, metaclass=SortableABCMeta):
         else:
             selections = [view.sel()[0]]
 
+        regions = self.regions
         for s in selections:
-            for r in self.regions:
-                if r.contains(s):
-                    break
-            else:
+            if not regions.contains(s):
                 return False
 
         return True
@@ -388,9 +809,62 @@ class EntitySelector(object, metaclass=SortableABCMeta):
 
 class DocLink(EntitySelector):
 
-    def __init__(self, view, search_string = None, search_region = None, **kwargs):
+    # Maximum number of documentation lookups cached for the class. Set this
+    # to a positive number in a subclass to cache the results of lookup_doc.
+    DocCacheSize = 0
+
+    # Number of seconds after which a cached lookup expires, or None if
+    # cached lookups do not expire.
+    DocCacheTTL = None
+
+    # Dictionary of LRUCache objects keyed by DocLink class.
+    DocCaches = dict()
+
+    # Returned by get_doc while the documentation is being prefetched.
+    DOC_PENDING = PrefetchTask.PENDING
+
+    # PrefetchTask looking up the documentation in the background, set on
+    # the instance by prefetch_doc
+    _prefetch_task = None
+
+    # Number of the content being shown in each output panel, keyed by
+    # (window ID, panel name). Content still being appended to a panel stops
+    # when new content is shown in it.
+    PanelGenerations = dict()
+
+    # Navigations waiting for files opened by show_doc_in_file to load.
+    PendingNavigations = NavigationRegistry()
+
+    # Dictionary of DefinitionIndex objects, keyed by the tuple returned by
+    # definition_index_key.
+    DefinitionIndexes = dict()
+
+    # Keys of the definition indexes waiting to be saved after an update.
+    # Updates within DefinitionIndexSaveDelay milliseconds of each other are
+    # saved once.
+    PendingIndexSaves = set()
+    DefinitionIndexSaveDelay = 5000
+
+    # The opening and closing HTML wrapped around popup content.
+    POPUP_HEADER = '<html><body>'
+
+    POPUP_FOOTER = '</body></html>'
+
+    # LRUCache of the most recently used popup style elements, keyed by
+    # (color scheme, additional style). It is cleared when the color scheme
+    # setting changes.
+    PopupStyles = LRUCache(16)
+
+    # The color scheme the popup styles were generated for, and the
+    # StyleSheetManager used to generate them.
+    PopupColorScheme = None
+    PopupStyleSheetManager = None
+
+    def __init__(self, view, search_string = None, search_region = None,
+                 check_selection = True, **kwargs):
         if search_region is not None:
-            if DocLink.selection_in_region(view, search_region):
+            if ((not check_selection) or
+                    DocLink.selection_in_region(view, search_region)):
                 super(DocLink, self).__init__(view, search_string = search_string,
                                               search_region = search_region,
                                               **kwargs)
@@ -413,6 +887,166 @@ class DocLink(EntitySelector):
         """This is called to show the documentation for an entity."""
         pass
 
+    def lookup_doc(self):
+        """Return the documentation content for the entity.
+
+        Subclasses doing expensive work to find documentation can override
+        this and call get_doc from show_doc, so the result can be cached and
+        prefetched.
+
+        """
+        return None
+
+    def doc_cache_version(self):
+        """Return a value identifying the version of the documentation
+        source.
+
+        Cached lookups are keyed on the entity and this value, and are only
+        reused while it is unchanged. By default, this is None, so cached
+        lookups are only dropped when they expire after DocCacheTTL or are
+        invalidated. Subclasses reading documentation from files can return
+        file_version of those files.
+
+        """
+        return None
+
+    @staticmethod
+    def file_version(file_name):
+        """Return the file name and modification time of a file."""
+        try:
+            return (file_name, os.path.getmtime(file_name))
+        except OSError:
+            return (file_name, None)
+
+    def doc_cache_key(self):
+        return (self.search_string, self.doc_cache_version())
+
+    @classmethod
+    def get_doc_cache(cls):
+        """Return the LRUCache for the class, or None if caching is off."""
+        if not cls.DocCacheSize:
+            return None
+        try:
+            return DocLink.DocCaches[cls]
+        except KeyError:
+            cache = DocLink.DocCaches[cls] = LRUCache(cls.DocCacheSize,
+                                                      cls.DocCacheTTL)
+            return cache
+
+    def get_doc(self):
+        """Return the documentation content for the entity.
+
+        The result of lookup_doc is cached if the class has a DocCacheSize.
+        A prefetch of the documentation is used rather than repeated. This
+        never waits for a running prefetch: DOC_PENDING is returned until it
+        completes. DocLinkCommand only calls show_doc once the prefetch has
+        finished, so show_doc always gets the content; elsewhere, use
+        request_doc to have it delivered when ready.
+
+        """
+        key = self.doc_cache_key()
+        cache = self.get_doc_cache()
+        task = self._prefetch_task
+        if (task is not None) and (task.key == key):
+            content = task.result()
+            if content is DocLink.DOC_PENDING:
+                return content
+        else:
+            content = LRUCache.MISSING if cache is None else cache.get(key)
+            if content is not LRUCache.MISSING:
+                return content
+            content = self.lookup_doc()
+        if cache is not None:
+            cache.put(key, content)
+        return content
+
+    def request_doc(self, callback):
+        """Call callback with the documentation content for the entity.
+
+        If the documentation is being prefetched, callback is called on the
+        main thread once the prefetch completes, rather than blocking until
+        then. Otherwise callback is called immediately with the result of
+        get_doc. callback is not called if there is no documentation.
+
+        """
+        def deliver():
+            content = self.get_doc()
+            if (content is not None) and (content is not DocLink.DOC_PENDING):
+                callback(content)
+
+        self.after_prefetch(deliver)
+
+    def after_prefetch(self, callback):
+        """Call callback once the documentation prefetch has finished.
+
+        If the prefetch is running, callback is called without arguments on
+        the main thread when it completes. Otherwise it is called
+        immediately.
+
+        """
+        task = self._prefetch_task
+        if ((task is None) or (task.key != self.doc_cache_key()) or
+                not task.add_done_callback(
+                    lambda: sublime.set_timeout(callback, 0))):
+            callback()
+
+    def enable_doc_prefetch(self):
+        """
+        Return True to start looking up the documentation in the background
+        as soon as the DocLink is assigned to the view, so get_doc can return
+        it immediately. Requires lookup_doc to be overridden.
+
+        """
+        return False
+
+    @classmethod
+    def get_prefetch_pool(cls):
+        """Return the WorkerPool used to prefetch documentation."""
+        return worker_pool('DocPrefetch', 'doc_prefetch_threads')
+
+    def prefetch_doc(self):
+        """Look up the documentation on the prefetch worker pool.
+
+        Only one prefetch runs per view; a new selector cancels the previous
+        prefetch.
+
+        """
+        key = self.doc_cache_key()
+        cache = self.get_doc_cache()
+        if (cache is not None) and (key in cache):
+            return
+
+        task = self._prefetch_task = PrefetchTask(key, self.lookup_doc)
+        DocLink.get_prefetch_pool().submit(
+            self.view.id(), task.run, lambda result: self.prefetch_done(task))
+
+    def prefetch_done(self, task):
+        """Cache prefetched documentation."""
+        cache = self.get_doc_cache()
+        if (cache is not None) and task.done:
+            cache.put(task.key, task.result())
+
+    @staticmethod
+    def cancel_prefetch(view_id):
+        """Cancel the documentation prefetch running for a view."""
+        cancel_worker_job('DocPrefetch', view_id)
+
+    @classmethod
+    def invalidate_doc_cache(cls, search_string=None):
+        """Remove cached lookups for the class.
+
+        Keyword arguments:
+        search_string - if given, only lookups for this entity are removed
+
+        """
+        cache = DocLink.DocCaches.get(cls)
+        if cache is None:
+            return 0
+        elif search_string is None:
+            return cache.invalidate()
+        else:
+            return cache.invalidate(lambda k: k[0] == search_string)
+
     @staticmethod
     def selection_in_region(view, region):
         """Return True if any view selections are in the region."""
@@ -451,24 +1085,31 @@ class DocLink(EntitySelector):
         """Adds regions to the view and assigns the DocFinder to the view."""
         if ((view is not None) and (selector is not None) and
             isinstance(selector, DocLink) and selector.enable_doc_link()):
-            view.add_regions('doc_link', selector.regions,
+            view.add_regions('doc_link', list(selector.regions),
                              view.scope_name(selector.regions[0].begin()),
                              flags = (sublime.DRAW_NO_FILL |
                                       sublime.DRAW_NO_OUTLINE |
                                       sublime.DRAW_STIPPLED_UNDERLINE |
                                       sublime.HIDE_ON_MINIMAP)
                          )
+            if selector.enable_doc_prefetch():
+                selector.prefetch_doc()
 
     @staticmethod
     def erase_regions(view = None, **kwargs):
         """Clears regions from the view and clears the DocFinder assigned to the view."""
         if view is not None:
             view.erase_regions('doc_link')
+            DocLink.cancel_prefetch(view.id())
 
     def enable_doc_link(self):
         """Return True to allow DocLink functionality for the EntitySelector."""
         return True
 
+    def clear_view(self):
+        super(DocLink, self).clear_view()
+        self.view.erase_regions('doc_link')
+
     def enable_add_doc(self):
         return hasattr(self, 'add_doc')
 
@@ -479,8 +1120,17 @@ class DocLink(EntitySelector):
     def has_popup_support(self):
         return TOOLTIP_SUPPORT
 
-    def show_doc_in_popup(self, content, **kwargs):
-        '''Opens the specified content in a popup.'''
+    def show_doc_in_popup(self, content=None, **kwargs):
+        '''Opens the specified content in a popup.
+
+        If no content is given, the content passed by request_doc is shown.
+
+        '''
+        if content is None:
+            self.request_doc(
+                lambda content: self.show_doc_in_popup(content, **kwargs))
+            return
+
         if not self.has_popup_support():
             logger.warning(
                 'Sublime Text version (%s) unable to display popups',
@@ -494,43 +1144,300 @@ class DocLink(EntitySelector):
         kwargs['max_width'] = max_width
         kwargs['max_height'] = max_height
 
-        if STYLED_POPUP_AVAILABLE:
-            manager = styled_popup.StyleSheetManager()
-            stylesheet = manager.get_stylesheet(
-                self.view.settings().get("color_scheme"))["content"]
-
-            style = stylesheet
-        else:
-            style = ''
-
         try:
             kwargs['on_navigate'] = self.popup_navigate
         except AttributeError:
             pass
 
-        if additional_style:
-            style += additional_style
+        style = DocLink.get_popup_style(
+            self.view.settings().get("color_scheme"), additional_style)
+        content = ''.join((DocLink.POPUP_HEADER, style, msg,
+                           DocLink.POPUP_FOOTER))
+        self.view.show_popup(content, **kwargs)
+
+    @staticmethod
+    def get_popup_style(color_scheme, additional_style=''):
+        """Returns the style element for popups using the color scheme.
+
+        The stylesheet is generated once per color scheme and additional
+        style, and reused until the color scheme setting changes.
+
+        """
+        key = (color_scheme, additional_style)
+        style = DocLink.PopupStyles.get(key)
+        if style is not LRUCache.MISSING:
+            return style
+
+        if STYLED_POPUP_AVAILABLE:
+            if DocLink.PopupStyleSheetManager is None:
+                DocLink.PopupStyleSheetManager = (
+                    styled_popup.StyleSheetManager())
+            style = DocLink.PopupStyleSheetManager.get_stylesheet(
+                color_scheme)["content"]
+        else:
+            style = ''
+
+        if additional_style:
+            style += additional_style
         if style:
             style = '<style>{0}</style>'.format(style)
 
-        content = '<html><body>{0}{1}</body></html>'.format(style, msg)
-        self.view.show_popup(content, **kwargs)
+        DocLink.PopupStyles.put(key, style)
+        return style
 
-    def show_doc_in_panel(self, content, panel_name='doc_link_content',
+    @staticmethod
+    def color_scheme_changed():
+        """Clears the popup styles if the color scheme setting changed."""
+        color_scheme = sublime.load_settings(
+            'Preferences.sublime-settings').get('color_scheme')
+        if color_scheme != DocLink.PopupColorScheme:
+            DocLink.PopupColorScheme = color_scheme
+            DocLink.PopupStyles.invalidate()
+            DocLink.PopupStyleSheetManager = None
+
+    def show_doc_in_panel(self, content=None, panel_name='doc_link_content',
                           syntax="Packages/Text/Plain text.tmLanguage"):
+        """Shows the content in an output panel.
+
+        If no content is given, the content passed by request_doc is shown.
+
+        """
+        if content is None:
+            self.request_doc(lambda content: self.show_doc_in_panel(
+                content, panel_name, syntax))
+            return
+
         window = sublime.active_window()
-        output_panel = window.create_output_panel(panel_name)
-        output_panel.set_read_only(False)
-        output_panel.run_command('entity_select_insert_in_view',
-                                 {'text': content})
-        output_panel.set_read_only(True)
-        output_panel.assign_syntax(syntax)
+        output_panel = DocLink.get_output_panel(window, panel_name)
+        if output_panel.settings().get('syntax') != syntax:
+            output_panel.assign_syntax(syntax)
+
+        panel_key = (window.id(), panel_name)
+        generation = DocLink.PanelGenerations.get(panel_key, 0) + 1
+        DocLink.PanelGenerations[panel_key] = generation
+        chunks = DocLink.iter_chunks(
+            content, get_setting('panel_chunk_size', 16384))
+        DocLink.append_to_panel(output_panel, panel_key, generation, chunks,
+                                clear=True)
         window.run_command('show_panel',
                            {'panel': 'output.'+panel_name})
 
+    @staticmethod
+    def get_output_panel(window, panel_name):
+        """Returns the output panel with the given name, creating it only
+        if it does not exist yet.
+
+        """
+        try:
+            output_panel = window.find_output_panel(panel_name)
+        except AttributeError:
+            output_panel = None
+        if output_panel is None:
+            output_panel = window.create_output_panel(panel_name)
+        return output_panel
+
+    @staticmethod
+    def iter_chunks(content, size):
+        """Yields the content in chunks of roughly size characters.
+
+        content may be a string or an iterable of strings.
+
+        """
+        if isinstance(content, str):
+            for i in range(0, len(content), size):
+                yield content[i:i + size]
+            return
+
+        pieces = []
+        length = 0
+        for piece in content:
+            pieces.append(piece)
+            length += len(piece)
+            if length >= size:
+                yield ''.join(pieces)
+                pieces = []
+                length = 0
+        if pieces:
+            yield ''.join(pieces)
+
+    @staticmethod
+    def append_to_panel(output_panel, panel_key, generation, chunks,
+                        clear=False):
+        """Appends the next chunk to the output panel.
+
+        The remaining chunks are appended one at a time on the async thread,
+        until the content is exhausted or new content is shown in the panel.
+
+        Keyword arguments:
+        panel_key - the (window ID, panel name) key of the panel in
+            PanelGenerations
+        clear - if True, the panel is cleared before the chunk is added
+
+        """
+        if DocLink.PanelGenerations.get(panel_key) != generation:
+            return
+
+        chunk = next(chunks, None)
+        if (chunk is None) and not clear:
+            return
+
+        output_panel.set_read_only(False)
+        output_panel.run_command(
+            'entity_select_insert_in_view',
+            {'text': chunk or '',
+             'point': 0 if clear else output_panel.size(),
+             'clear': clear})
+        output_panel.set_read_only(True)
+
+        if chunk is not None:
+            sublime.set_timeout_async(
+                lambda: DocLink.append_to_panel(output_panel, panel_key,
+                                                generation, chunks), 0)
+
+    @classmethod
+    def definition_pattern(cls):
+        """
+        Return a regular expression matching the definitions of entities, or
+        None if the class does not use the definition index.
+
+        The entity name is taken from a group named 'name' if there is one,
+        or from the whole match otherwise.
+
+        """
+        return None
+
+    @classmethod
+    def definition_file_patterns(cls):
+        """Return a list of file name patterns of the files to index."""
+        return ['*']
+
+    @classmethod
+    def definition_index_key(cls, window):
+        return (cls.definition_pattern(),
+                tuple(cls.definition_file_patterns()),
+                tuple(window.folders()))
+
+    @classmethod
+    def get_definition_pool(cls):
+        """Return the WorkerPool used to maintain definition indexes."""
+        return worker_pool('DefinitionIndex')
+
+    @classmethod
+    def get_definition_index(cls, window):
+        """Return the DefinitionIndex for the window's folders.
+
+        None is returned if the class has no definition_pattern or the
+        window has no folders. A new index is loaded from the cache and then
+        refreshed in the background. It is ready as soon as the cache has
+        loaded, before the refresh, or once it has been built if there is no
+        cache.
+
+        """
+        if (cls.definition_pattern() is None) or not window.folders():
+            return None
+
+        key = cls.definition_index_key(window)
+        try:
+            return DocLink.DefinitionIndexes[key]
+        except KeyError:
+            pass
+
+        file_name = 'definitions-%s.json' % hashlib.md5(
+            repr(key).encode('utf-8')).hexdigest()
+        index = DocLink.DefinitionIndexes[key] = DefinitionIndex(
+            window.folders(), cls.definition_pattern(),
+            cls.definition_file_patterns(),
+            os.path.join(sublime.cache_path(), 'EntitySelect', file_name))
+
+        def load_and_refresh():
+            token = WorkerPool.current_token()
+            index.load()
+            if index.refresh(lambda: token.cancelled):
+                index.save()
+
+        DocLink.get_definition_pool().submit(('refresh', key),
+                                             load_and_refresh)
+        return index
+
+    @staticmethod
+    def update_definition_indexes(path):
+        """Rescan a saved file in the definition indexes that include it."""
+        for key, index in list(DocLink.DefinitionIndexes.items()):
+            if index.ready and index.includes(path):
+                DocLink.get_definition_pool().submit(
+                    ('update', key, path),
+                    lambda index=index: index.update_file(path))
+                DocLink.schedule_definition_index_save(key, index)
+
+    @staticmethod
+    def schedule_definition_index_save(key, index):
+        """Save a definition index once updates to it have settled.
+
+        The save is delayed by DefinitionIndexSaveDelay, and any further
+        updates made in the meantime are included in the same save.
+
+        """
+        if key in DocLink.PendingIndexSaves:
+            return
+        DocLink.PendingIndexSaves.add(key)
+
+        def save():
+            DocLink.PendingIndexSaves.discard(key)
+            DocLink.get_definition_pool().submit(('save', key), index.save)
+
+        sublime.set_timeout_async(save, DocLink.DefinitionIndexSaveDelay)
+
+    def find_definitions(self, name=None):
+        """Return a list of (file, row, col) tuples for the definitions of
+        the entity, or of name if given.
+
+        The definitions are looked up in the definition index, without
+        touching the file system. None is returned while the index is still
+        being loaded or built.
+
+        """
+        window = self.view.window()
+        index = None if window is None else self.get_definition_index(window)
+        if index is None:
+            return []
+        if name is None:
+            name = self.search_string
+        if not index.ready:
+            return None
+        return index.definitions(name)
+
+    def show_definition(self, name=None, show_at_top=True):
+        """Open the first definition of the entity found in the definition
+        index.
+
+        Returns a status message suffix, like show_doc_in_file.
+
+        """
+        definitions = self.find_definitions(name)
+        if definitions is None:
+            return 'definition index loading'
+        elif not definitions:
+            return 'not found'
+
+        file_, row, col = definitions[0]
+        current_file = self.view.file_name()
+        if ((current_file is not None) and
+                (os.path.normcase(current_file) == os.path.normcase(file_))):
+            region = sublime.Region(self.view.text_point(row - 1, col - 1))
+            return self.show_doc_in_file(current_file, region,
+                                         show_at_top=show_at_top)
+        return self.show_doc_in_file(file_, row=row, col=col,
+                                     show_at_top=show_at_top,
+                                     check_exists=False)
+
     def show_doc_in_file(self, file_, region=None, row=0, col=0,
-                         show_at_top=True):
-        """Opens the file and shows the given region."""
+                         show_at_top=True, check_exists=True):
+        """Opens the file and shows the given region.
+
+        Keyword arguments:
+        check_exists - if False, the file is assumed to exist
+
+        """
         status_message_suffix = ''
 
         if (file_ is None):
@@ -548,7 +1455,7 @@ class DocLink(EntitySelector):
                 self.view.show(region, True)
 
             status_message_suffix = 'found in current file'
-        elif not os.path.exists(file_):
+        elif check_exists and not os.path.exists(file_):
             status_message_suffix = 'not found'
         else:
             status_message_suffix = 'found in other file'
@@ -557,23 +1464,35 @@ class DocLink(EntitySelector):
                     "{0}:{1}:{2}".format(file_, row, col),
                     sublime.ENCODED_POSITION)
                 if ((row != 0) and (col != 0)):
-                    sublime.set_timeout_async(
-                        lambda: self.show_and_select_opened_file(
-                            view, region, row, col, show_at_top), 0)
+                    self.navigate_when_loaded(view, region, row, col,
+                                              show_at_top)
             else:
                 view = self.view.window().open_file(
                     file_, sublime.ENCODED_POSITION)
-                sublime.set_timeout_async(
-                    lambda: self.show_and_select_opened_file(
-                        view, region, row, col, show_at_top), 0)
+                self.navigate_when_loaded(view, region, row, col,
+                                          show_at_top)
 
         return status_message_suffix
 
+    def navigate_when_loaded(self, view, region, row, col, show_at_top):
+        """Show the selection in a just opened file once it has loaded.
+
+        The navigation is completed by the on_load listener, so this returns
+        immediately.
+
+        """
+        DocLink.PendingNavigations.add(
+            view,
+            lambda v: self.show_and_select_opened_file(v, region, row, col,
+                                                       show_at_top),
+            get_setting('navigation_timeout', 10000))
+
     def show_and_select_opened_file(self, view, region, row, col, show_at_top):
-        """Helper method to show the given selection in a just opened file."""
-        while view.is_loading():
-            time.sleep(0.01)
+        """Helper method to show the given selection in a just opened file.
+
+        This is called once the file has loaded.
 
+        """
         s = view.sel()
         s.clear()
         if region is not None:
@@ -610,9 +1529,42 @@ class Highlight(EntitySelector):
 
     SHOW_ALL_COMMAND = 'show_all'
 
+    # Scopes for the highlight and show all commands.
+    VIEW_SCOPE = 'view'
+
+    PROJECT_SCOPE = 'project'
+
     STATUS_KEY = 'entity_select_num_highlights'
 
-    def __init__(self, view, search_string=None, search_region=None, **kwargs):
+    # Number of characters scanned at a time by progressive highlighting.
+    HighlightChunkSize = 200000
+
+    # Number of highlight regions drawn under each region key. Keys holding
+    # more than twice this many regions are split.
+    HighlightKeySize = 1024
+
+    # Number of region keys used to draw highlights so far.
+    DrawnKeyCount = 0
+
+
+    # Dictionary of ProjectIndex objects, keyed by the tuple returned by
+    # project_index_key. Entries are dropped when their window closes.
+    ProjectIndexes = dict()
+
+    # Dictionary of callbacks waiting for a ProjectIndex to be built, keyed
+    # like ProjectIndexes.
+    ProjectIndexCallbacks = dict()
+
+    # The (view ID, BufferSnapshot) being scanned by the highlight job
+    # running on the current thread.
+    _job_snapshot = threading.local()
+
+    # Number of the latest scan submitted for each view, keyed by view ID.
+    # Scans run on the async thread are skipped once superseded.
+    ScanGenerations = dict()
+
+    def __init__(self, view, search_string=None, search_region=None,
+                 target_regions=None, **kwargs):
         super(Highlight, self).__init__(view, search_string=search_string,
                                         search_region=search_region,
                                         **kwargs)
@@ -620,8 +1572,50 @@ class Highlight(EntitySelector):
             self.search_string = view.substr(search_region)
         else:
             self.search_string = search_string
-        self.regions = [search_region]
-        self.highlight_regions = []
+        if target_regions:
+            # The regions a preemptive highlight was created for
+            self.regions = target_regions
+        else:
+            self.regions = [search_region]
+        self.highlight_regions = RegionIndex()
+
+        # Change count of the buffer the highlight regions were computed for.
+        # None if the regions need to be computed from scratch.
+        self.highlight_change_count = None
+
+        # Text changes recorded since the highlight regions were computed, as
+        # a list of (change count, [(begin, end, length), ...]) tuples.
+        self._pending_changes = []
+        self._pending_changes_lock = threading.Lock()
+
+        # Ranges of the buffer, as [begin, end] lists, whose highlight regions
+        # need to be rescanned.
+        self._dirty_ranges = []
+
+        # Ranges of the buffer, as [begin, end] lists, that progressive
+        # highlighting has not scanned yet, and the number of the current
+        # highlight pass.
+        self._unscanned_ranges = []
+        self._highlight_pass = 0
+
+        # Functions waiting for progressive highlighting to finish
+        self._complete_callbacks = []
+
+        # Guards the highlight regions and the scanned and dirty ranges,
+        # which are updated from the async thread by the highlight jobs and
+        # from the main thread by the commands scanning on demand.
+        self._scan_lock = threading.RLock()
+
+        # The change count and RegionIndex of the last full scan made by the
+        # default get_highlight_regions_in_region
+        self._full_scan = None
+
+        # Ranges of the buffer whose highlight regions are drawn under
+        # separate region keys, as [begin, key] lists sorted by begin. Each
+        # range extends to the beginning of the next, so an edit only
+        # redraws the keys covering it, and Sublime moves the regions of the
+        # other keys itself.
+        self._drawn_ranges = []
 
     def highlight_description(self, command):
         """Return the command description."""
@@ -692,26 +1686,801 @@ class Highlight(EntitySelector):
         """
         return True
 
-    def highlight(self):
-        """Assign a highlighter to the view and add the regions to the view."""
-        hr = self.get_highlight_regions()
-        if hr:
-            self.highlight_regions.clear()
-            self.highlight_regions.extend(hr)
+    @property
+    def highlight_regions(self):
+        """The highlighted regions, stored in a sorted RegionIndex."""
+        return self._highlight_regions
+
+    @highlight_regions.setter
+    def highlight_regions(self, value):
+        if isinstance(value, RegionIndex):
+            self._highlight_regions = value
+        else:
+            self._highlight_regions = RegionIndex(value)
+
+    def enable_incremental_highlight(self):
+        """
+        Return True if the highlight regions can be kept up to date by
+        rescanning only the lines affected by an edit.
+
+        Highlighters returning True should provide a highlight_pattern or
+        override get_highlight_regions_in_region. This requires a version of
+        Sublime Text providing TextChangeListener; otherwise the whole file
+        is rescanned after each edit.
+
+        """
+        return False
+
+    def can_scan_regions(self):
+        """
+        Return True if get_highlight_regions_in_region scans only the given
+        region, rather than looking it up in a full scan.
+
+        """
+        return ((self.highlight_pattern() is not None) or
+                (type(self).get_highlight_regions_in_region is not
+                 Highlight.get_highlight_regions_in_region))
+
+    def highlight_pattern(self):
+        """
+        Return a regular expression matching the regions to highlight, or
+        None.
+
+        Highlighters returning a pattern are searched in a snapshot of the
+        buffer on the highlight worker pool, without calls to the view.
+        Otherwise get_highlight_regions and get_highlight_regions_in_region
+        are called on Sublime's async thread.
+
+        """
+        return None
+
+    def enable_progressive_highlight(self):
+        """
+        Return True to highlight the visible part of the view first and scan
+        the rest of the view in chunks in the background.
+
+        Highlighters returning True should override
+        get_highlight_regions_in_region, which is called for each chunk.
+
+        """
+        return False
+
+    @classmethod
+    def get_worker_pool(cls):
+        """Return the WorkerPool used to compute highlight regions."""
+        return worker_pool('Highlight', 'highlight_worker_threads', 2)
+
+    def enable_project_highlight(self):
+        """
+        Return True to allow the occurrences of the entity to be listed for
+        the whole project.
+
+        The files of the project are indexed using project_index_pattern and
+        project_file_patterns, and get_project_search_term is looked up in
+        the index. By default, this is enabled for highlighters defining
+        both.
+
+        """
+        return ((self.project_index_pattern() is not None) and
+                (self.project_file_patterns() is not None))
+
+    @classmethod
+    def project_index_pattern(cls):
+        """
+        Return a regular expression matching the entities to index, or None
+        if the class does not use a project index.
+
+        """
+        return None
+
+    @classmethod
+    def project_file_patterns(cls):
+        """
+        Return a list of file name patterns of the files to index, or None
+        if the class does not use a project index.
+
+        """
+        return None
+
+    def get_project_search_term(self):
+        """Return the text to look up in the project index."""
+        return self.search_string
+
+    @classmethod
+    def get_project_index_pool(cls):
+        """Return the WorkerPool used to build and update project indexes.
+
+        It is separate from the highlight pool, so a build does not hold up
+        the highlight jobs.
+
+        """
+        return worker_pool('ProjectIndex')
+
+    @classmethod
+    def project_index_key(cls, window):
+        return (window.id(), cls.project_index_pattern(),
+                tuple(cls.project_file_patterns()),
+                tuple(window.folders()))
+
+    @classmethod
+    def with_project_index(cls, window, callback):
+        """Call callback with the ProjectIndex for the window's folders.
+
+        If the index has not been built yet, it is built on the project
+        index worker pool, and callback is called on the async thread once
+        it is ready.
+
+        """
+        key = cls.project_index_key(window)
+        try:
+            index = Highlight.ProjectIndexes[key]
+        except KeyError:
+            Highlight.release_closed_project_indexes()
+            index = Highlight.ProjectIndexes[key] = ProjectIndex(
+                window.folders(), cls.project_index_pattern(),
+                cls.project_file_patterns())
+
+        if index.ready:
+            callback(index)
+            return
+
+        callbacks = Highlight.ProjectIndexCallbacks.setdefault(key, [])
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            def build():
+                token = WorkerPool.current_token()
+                built = False
+                try:
+                    built = index.build(lambda: token.cancelled)
+                finally:
+                    # Release the waiting callbacks even if the build failed
+                    # or was cancelled, so the next request builds again
+                    sublime.set_timeout_async(
+                        lambda: Highlight.project_index_built(key, built), 0)
+
+            sublime.status_message('Building project index...')
+            Highlight.get_project_index_pool().submit(('build', key), build)
+
+    @staticmethod
+    def project_index_built(key, built):
+        """Run the callbacks waiting for a project index build.
+
+        If the build failed or was cancelled, the callbacks are dropped and
+        the failure is reported in the status bar. Nothing is reported if
+        the index was released because its window closed.
+
+        """
+        callbacks = Highlight.ProjectIndexCallbacks.pop(key, [])
+        index = Highlight.ProjectIndexes.get(key)
+        if index is None:
+            return
+        elif not built:
+            sublime.status_message('Building project index failed')
+            return
+        for callback in callbacks:
+            callback(index)
+
+    @staticmethod
+    def update_project_indexes(path):
+        """Rescan a saved file in the project indexes that include it."""
+        for key, index in list(Highlight.ProjectIndexes.items()):
+            if index.ready and index.includes(path):
+                Highlight.get_project_index_pool().submit(
+                    ('update', key, path),
+                    lambda index=index: index.update_file(path))
+
+    @staticmethod
+    def release_closed_project_indexes():
+        """Drop the project indexes of windows that have been closed."""
+        window_ids = set(w.id() for w in sublime.windows())
+        for key in list(Highlight.ProjectIndexes):
+            if key[0] not in window_ids:
+                Highlight.ProjectIndexes.pop(key, None)
+                Highlight.ProjectIndexCallbacks.pop(key, None)
+                cancel_worker_job('ProjectIndex', ('build', key))
+
+    def find_project_occurrences(self, on_done):
+        """Look up the entity in the project index.
+
+        on_done is called on the async thread with a list of
+        (display string, encoded position) tuples, one for each occurrence.
+
+        """
+        window = self.view.window()
+        if window is None or not window.folders():
+            sublime.status_message('No project folders to search')
+            return
+
+        term = self.get_project_search_term()
+
+        def lookup(index):
+            Highlight.get_worker_pool().submit(
+                ('project_lookup', window.id()),
+                lambda: self.get_project_display_items(
+                    index, index.occurrences(term)),
+                on_done)
+
+        self.with_project_index(window, lookup)
+
+    def get_project_display_items(self, index, occurrences):
+        """
+        Return a list of (display string, encoded position) tuples for
+        a list of (path, begin, end) occurrences.
+
+        Each file is read once, and rows and line text are looked up in its
+        line index.
+
+        """
+        items = []
+        current_path = snapshot = None
+        for path, begin, end in occurrences:
+            if path != current_path:
+                current_path = path
+                try:
+                    with open(path, encoding='utf-8', errors='replace') as f:
+                        snapshot = BufferSnapshot(f.read(), None)
+                except (IOError, OSError):
+                    snapshot = BufferSnapshot('', None)
+            row = snapshot.row(begin)
+            col = begin - snapshot.line_starts[row]
+            name = path
+            for folder in index.folders:
+                if path.startswith(folder + os.sep):
+                    name = os.path.relpath(path, folder)
+                    break
+            items.append(('%s:%s: %s' % (name, row + 1,
+                                         snapshot.line_text(begin).strip()),
+                          '%s:%s:%s' % (path, row + 1, col + 1)))
+        return items
+
+    def highlight(self, on_done=None):
+        """Assign a highlighter to the view and add the regions to the view.
+
+        The highlight regions are computed by submit_scan. A new highlight
+        in the view cancels the previous one. The regions are only committed
+        if the buffer has not changed since the snapshot was taken;
+        otherwise they are computed again.
+
+        Keyword arguments:
+        on_done - An optional function called with the highlighter once the
+            highlight regions have been committed.
+
+        """
+        with self._scan_lock:
+            self._highlight_pass += 1
+            self._unscanned_ranges = []
+        snapshot = self.get_buffer_snapshot()
+        if self.enable_progressive_highlight():
+            visible = self.view.visible_region()
+            region = sublime.Region(*snapshot.line(
+                min(visible.begin(), len(snapshot)),
+                min(visible.end(), len(snapshot))))
+        else:
+            region = None
+
+        self.submit_scan(
+            lambda: RegionIndex(self.scan_region(snapshot, region)),
+            lambda hr: self.commit_highlight(hr, snapshot.change_count,
+                                             region, on_done))
+
+    def submit_scan(self, job, on_done):
+        """Run a scan job and call on_done with its result on the async
+        thread.
+
+        Highlighters with a highlight_pattern only search a buffer snapshot,
+        so their jobs run on the highlight worker pool, where a slow search
+        does not hold up the async thread. Other highlighters call the view
+        API, so their jobs run on the async thread, consistent with the
+        other view events. Either way, a new scan for the view supersedes
+        the previous one.
+
+        """
+        view_id = self.view.id()
+        generation = Highlight.ScanGenerations.get(view_id, 0) + 1
+        Highlight.ScanGenerations[view_id] = generation
+        if self.highlight_pattern() is not None:
+            Highlight.get_worker_pool().submit(view_id, job, on_done)
+            return
+
+        Highlight.get_worker_pool().cancel(view_id)
+
+        def run():
+            if Highlight.ScanGenerations.get(view_id) == generation:
+                on_done(job())
+
+        sublime.set_timeout_async(run, 0)
+
+    def commit_highlight(self, hr, change_count, region, on_done=None):
+        """Commit computed highlight regions and show them in the view.
+
+        Keyword arguments:
+        hr - the computed highlight regions
+        change_count - the change count of the buffer the regions were
+            computed for
+        region - the region of the view that was scanned, or None if the
+            whole view was scanned. The rest of the view is scanned
+            progressively.
+        on_done - passed on from highlight
+
+        """
+        if self.view.change_count() != change_count:
+            self.highlight(on_done)
+            return
+
+        with self._scan_lock:
+            self.highlight_regions = hr
+            self.reset_text_changes(change_count)
+            if region is not None:
+                size = self.view.size()
+                if region.end() < size:
+                    self._unscanned_ranges.append([region.end() + 1, size])
+                if region.begin() > 0:
+                    self._unscanned_ranges.append([0, region.begin() - 1])
+
+        if self.highlight_regions or self._unscanned_ranges:
             self.assign_highlighter_to_view()
             self.add_highlight_regions()
+            self.schedule_next_chunk()
         else:
             self.remove_highlighter_from_view()
+        self.run_complete_callbacks()
+
+        if on_done is not None:
+            on_done(self)
+
+    def highlight_in_progress(self):
+        """Return True if progressive highlighting has not finished."""
+        return bool(self._unscanned_ranges)
+
+    def highlight_cancelled(self):
+        """
+        Return True if the highlight being computed on the current thread
+        has been cancelled.
+
+        Slow implementations of get_highlight_regions can check this
+        periodically and return early.
+
+        """
+        token = WorkerPool.current_token()
+        return (token is not None) and token.cancelled
+
+    def get_buffer_snapshot(self):
+        """Return a BufferSnapshot of the view's text.
+
+        The snapshot is shared by everything using the view until the buffer
+        changes, so highlighters can search it instead of making repeated
+        calls to the view. Within a highlight job, the snapshot the job is
+        scanning is returned.
+
+        """
+        job_snapshot = getattr(Highlight._job_snapshot, 'snapshot', None)
+        if (job_snapshot is not None) and (job_snapshot[0] == self.view.id()):
+            return job_snapshot[1]
+        return EntitySelector.get_view_data(self.view).buffer_snapshot(
+            self.view)
+
+    def schedule_next_chunk(self, delay=0):
+        """Schedule a scan of the next unscanned chunk of the view."""
+        if self._unscanned_ranges:
+            highlight_pass = self._highlight_pass
+            sublime.set_timeout_async(
+                lambda: self.scan_next_chunk(highlight_pass), delay)
+
+    def scan_next_chunk(self, highlight_pass):
+        """Scan the next unscanned chunk of the view on the worker pool.
+
+        Nothing is done if a new highlight pass has started or the
+        highlighter has been removed from the view.
+
+        """
+        if ((highlight_pass != self._highlight_pass) or
+                (Highlight.get_highlighter_for_view(self.view) is not self)):
+            return
+
+        with self._scan_lock:
+            if not self._unscanned_ranges:
+                return
+            begin, end = self._unscanned_ranges[0]
+
+        snapshot = self.get_buffer_snapshot()
+        if snapshot.change_count != self.highlight_change_count:
+            # Wait for the buffer changes to be applied
+            self.schedule_next_chunk(50)
+            return
+
+        lines = sublime.Region(*snapshot.line(
+            min(begin, len(snapshot)),
+            min(end, begin + self.HighlightChunkSize, len(snapshot))))
+        self.submit_scan(
+            lambda: self.scan_region(snapshot, lines),
+            lambda found: self.commit_chunk(highlight_pass,
+                                            snapshot.change_count, lines,
+                                            found))
+
+    def commit_chunk(self, highlight_pass, change_count, lines, found):
+        """Add the regions found in a chunk and show them in the view."""
+        if ((highlight_pass != self._highlight_pass) or
+                (Highlight.get_highlighter_for_view(self.view) is not self)):
+            return
+
+        if not self.add_scanned_regions(change_count, lines, found):
+            # Wait for the buffer changes to be applied
+            self.schedule_next_chunk(50)
+        elif self.highlight_regions or self.highlight_in_progress():
+            self.add_highlight_regions([(lines.begin(), lines.end())])
+            self.schedule_next_chunk()
+            self.run_complete_callbacks()
+        else:
+            self.remove_highlighter_from_view()
+            self.run_complete_callbacks()
+
+    def scan_unscanned_range(self, begin, end):
+        """Scan the lines from begin to end now and mark them as scanned.
+
+        Returns False if the buffer changed during the scan, in which case the
+        results are discarded.
+
+        """
+        snapshot = self.get_buffer_snapshot()
+        lines = sublime.Region(*snapshot.line(min(begin, len(snapshot)),
+                                              min(end, len(snapshot))))
+        scanned = self.add_scanned_regions(snapshot.change_count, lines,
+                                           self.scan_region(snapshot, lines))
+        if scanned:
+            self.run_complete_callbacks()
+        return scanned
+
+    def add_scanned_regions(self, change_count, lines, found):
+        """Replace the highlight regions within lines with those found.
+
+        Returns False, without changing anything, unless the regions were
+        found at the buffer's current change count.
+
+        """
+        with self._scan_lock:
+            if ((change_count is None) or
+                    (change_count != self.highlight_change_count) or
+                    (self.view.change_count() != change_count)):
+                return False
+
+            self.highlight_regions.remove_beginning_within(lines.begin(),
+                                                           lines.end())
+            self.highlight_regions.extend(found)
+            self._unscanned_ranges = Highlight.subtract_range(
+                self._unscanned_ranges, lines.begin(), lines.end())
+            return True
+
+    def ensure_scanned(self, begin, end, reverse=False, stop=None):
+        """Scan any unscanned parts of the view from begin to end now.
+
+        Keyword arguments:
+        reverse - If this is True, chunks are scanned from end to begin.
+        stop - An optional function called before each chunk with the point
+            up to which the view has been scanned. Scanning ends when it
+            returns True.
+
+        """
+        with self._scan_lock:
+            ranges = sorted(([max(b, begin), min(e, end)]
+                             for b, e in self._unscanned_ranges
+                             if (e >= begin) and (b <= end)),
+                            reverse=reverse)
+        for b, e in ranges:
+            while b <= e:
+                if reverse:
+                    chunk = (max(b, e - self.HighlightChunkSize), e)
+                    boundary = e
+                else:
+                    chunk = (b, min(e, b + self.HighlightChunkSize))
+                    boundary = b
+                if (stop is not None) and stop(boundary):
+                    return
+                if not self.scan_unscanned_range(*chunk):
+                    return
+                if reverse:
+                    e = chunk[0] - 1
+                else:
+                    b = chunk[1] + 1
+
+    def when_highlight_complete(self, callback):
+        """Call callback once the whole view has been scanned.
+
+        If progressive highlighting has not finished, callback is called
+        without arguments by the thread that scans the last chunk, usually
+        the async thread or a worker thread. Otherwise it is called now.
+
+        """
+        with self._scan_lock:
+            if self._unscanned_ranges:
+                self._complete_callbacks.append(callback)
+                return
+        callback()
+
+    def run_complete_callbacks(self):
+        """Call the functions waiting for the whole view to be scanned, if
+        it has been.
+
+        """
+        with self._scan_lock:
+            if self._unscanned_ranges:
+                return
+            callbacks, self._complete_callbacks = self._complete_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def scan_region(self, snapshot, region=None):
+        """Return the highlight regions in a snapshot of the buffer.
+
+        Only the regions beginning within region are returned, or all of them
+        if region is None. The snapshot is searched with highlight_pattern if
+        the highlighter provides one. Otherwise get_highlight_regions or
+        get_highlight_regions_in_region are called, and get_buffer_snapshot
+        returns the snapshot while they run.
+
+        """
+        pattern = self.highlight_pattern()
+        if pattern is not None:
+            return self.profile_call('highlight_pattern', self.search_snapshot,
+                                     pattern, snapshot, region)
+
+        Highlight._job_snapshot.snapshot = (self.view.id(), snapshot)
+        try:
+            if region is None:
+                return self.profile_call('get_highlight_regions',
+                                         self.get_highlight_regions)
+            found = self.profile_call('get_highlight_regions_in_region',
+                                      self.get_highlight_regions_in_region,
+                                      region)
+            return [r for r in found if region.contains(r.begin())]
+        finally:
+            Highlight._job_snapshot.snapshot = None
+
+    @staticmethod
+    def search_snapshot(pattern, snapshot, region=None):
+        """Return the regions matching pattern in a BufferSnapshot.
+
+        Only the matches beginning within region are returned, or all of them
+        if region is None.
+
+        """
+        if region is None:
+            begin, end = 0, len(snapshot)
+        else:
+            begin, end = region.begin(), region.end()
+        found = []
+        for match in re.compile(pattern).finditer(snapshot.text, begin):
+            if match.start() > end:
+                break
+            if match.end() > match.start():
+                found.append(sublime.Region(match.start(), match.end()))
+        return found
+
+    @staticmethod
+    def subtract_range(ranges, begin, end):
+        """Return ranges with the range from begin to end removed."""
+        remaining = []
+        for b, e in ranges:
+            if (e < begin) or (b > end):
+                remaining.append([b, e])
+                continue
+            if b < begin:
+                remaining.append([b, begin - 1])
+            if e > end:
+                remaining.append([end + 1, e])
+        return remaining
+
+    def update_highlight(self):
+        """Bring the highlight regions up to date after the buffer changed.
+
+        If incremental highlighting is enabled and the highlighter can scan
+        regions, the recorded text changes are applied to the stored regions
+        and only the affected lines are rescanned and drawn again. Otherwise
+        the highlight is recomputed.
+
+        """
+        if (not TEXT_CHANGE_SUPPORT or
+                not self.enable_incremental_highlight() or
+                not self.can_scan_regions() or
+                self.highlight_change_count is None):
+            self.highlight()
+            return
+
+        self.apply_text_changes()
+        if self.view.change_count() != self.highlight_change_count:
+            with self._pending_changes_lock:
+                pending = bool(self._pending_changes)
+            if not pending:
+                # A change was not recorded, so start over
+                self.highlight()
+            # Otherwise, the next modification event applies the rest
+            return
+
+        lines = self.rescan_dirty_ranges()
+        if lines:
+            if self.highlight_regions:
+                self.add_highlight_regions(
+                    [(l.begin(), l.end()) for l in lines])
+            else:
+                self.remove_highlighter_from_view()
+
+    def reset_text_changes(self, change_count):
+        """Discard recorded text changes up to the given change count.
+
+        The highlight regions must reflect the buffer at change_count. If the
+        buffer changed while they were computed, they are recomputed on the
+        next update.
+
+        """
+        if self.view.change_count() != change_count:
+            change_count = None
+        self.highlight_change_count = change_count
+        self._dirty_ranges = []
+        with self._pending_changes_lock:
+            self._pending_changes = [
+                c for c in self._pending_changes
+                if (change_count is not None) and (c[0] > change_count)]
+
+    def record_text_changes(self, change_count, changes):
+        """Record changes made to the buffer.
+
+        This is called on the main thread as the buffer changes, so it only
+        queues the changes for update_highlight.
+
+        Keyword arguments:
+        change_count - the change count of the buffer after the changes
+        changes - a list of (begin, end, length) tuples, one for each change,
+            meaning the text from begin to end was replaced by length
+            characters
+
+        """
+        with self._pending_changes_lock:
+            self._pending_changes.append((change_count, changes))
+
+    def apply_text_changes(self):
+        """Apply the recorded text changes to the stored highlight regions.
+
+        Highlight regions touching a change are dropped, and the changed text
+        is marked for rescanning.
+
+        """
+        with self._pending_changes_lock:
+            pending = self._pending_changes
+            self._pending_changes = []
+
+        with self._scan_lock:
+            for change_count, changes in pending:
+                if change_count <= self.highlight_change_count:
+                    continue
+                for begin, end, length in changes:
+                    self.highlight_regions.apply_edit(begin, end, length)
+                    Highlight.shift_drawn_ranges(self._drawn_ranges,
+                                                 begin, end, length)
+                    self._dirty_ranges = Highlight.adjust_ranges(
+                        self._dirty_ranges, begin, end, length)
+                    if self._unscanned_ranges:
+                        self._unscanned_ranges = Highlight.adjust_ranges(
+                            self._unscanned_ranges, begin, end, length,
+                            include_edit=False)
+                self.highlight_change_count = change_count
+
+    @staticmethod
+    def shift_drawn_ranges(ranges, begin, end, length):
+        """Move the beginnings of drawn ranges for the text from begin to
+        end being replaced by length characters.
+
+        Beginnings within the edited text move to its beginning, so the
+        ranges stay sorted. A range left empty is removed when it is next
+        drawn.
+
+        """
+        delta = length - (end - begin)
+        for r in ranges:
+            if r[0] > end:
+                r[0] += delta
+            elif r[0] > begin:
+                r[0] = begin
+
+    @staticmethod
+    def adjust_ranges(ranges, begin, end, length, include_edit=True):
+        """Return ranges adjusted for the text from begin to end being
+        replaced by length characters.
+
+        Ranges after the edit are shifted, and ranges touching it are merged
+        with the edited text. If include_edit is True, the edited text is
+        added as a range even if no range touches it.
+
+        """
+        delta = length - (end - begin)
+        new_begin = begin
+        new_end = begin + length
+        touched = include_edit
+        adjusted = []
+        for b, e in ranges:
+            if e < begin:
+                adjusted.append([b, e])
+            elif b > end:
+                adjusted.append([b + delta, e + delta])
+            else:
+                touched = True
+                new_begin = min(new_begin, b)
+                new_end = max(new_end, e + delta)
+        if touched:
+            adjusted.append([new_begin, new_end])
+            adjusted.sort()
+        return adjusted
+
+    def rescan_dirty_ranges(self):
+        """Rescan the lines containing the dirty ranges.
+
+        Returns the list of rescanned lines if the highlight regions were
+        updated, or an empty list. If the buffer changes during the scan,
+        the results are discarded and the ranges stay dirty.
+
+        """
+        if not self._dirty_ranges:
+            return []
+
+        change_count = self.highlight_change_count
+        lines = []
+        for begin, end in self._dirty_ranges:
+            line = self.view.line(sublime.Region(begin, end))
+            if lines and (line.begin() <= lines[-1].end() + 1):
+                lines[-1] = lines[-1].cover(line)
+            else:
+                lines.append(line)
+
+        found = []
+        for line in lines:
+            found.extend(r for r in self.get_highlight_regions_in_region(line)
+                         if line.contains(r.begin()))
+
+        with self._scan_lock:
+            if ((self.view.change_count() != change_count) or
+                    (self.highlight_change_count != change_count)):
+                return []
+
+            for line in lines:
+                self.highlight_regions.remove_beginning_within(line.begin(),
+                                                               line.end())
+            self.highlight_regions.extend(found)
+            self._dirty_ranges = []
+            return lines
 
     def assign_highlighter_to_view(self):
-        """Assign the highlighter to the view."""
+        """Assign the highlighter to the view.
+
+        The regions drawn by the highlighter it replaces are erased.
+
+        """
+        previous = Highlight.Highlighters.get(self.view.id())
         Highlight.Highlighters[self.view.id()] = self
+        if (previous is not None) and (previous is not self):
+            previous.erase_highlight_regions()
 
     def remove_highlighter_from_view(self):
         """Removes the highlighter from the view."""
         Highlight.Highlighters[self.view.id()] = None
         self.erase_highlight_regions()
 
+    @staticmethod
+    def release_highlighter(view_id):
+        """Drop the highlighter of a released view and cancel its scans.
+
+        The highlight regions and status are erased in case the view is
+        still open.
+
+        """
+        highlighter = Highlight.Highlighters.pop(view_id, None)
+        Highlight.ScanGenerations.pop(view_id, None)
+        cancel_worker_job('Highlight', view_id)
+        if highlighter is not None:
+            highlighter.erase_highlight_regions()
+
+    def estimated_size(self):
+        """Return the approximate number of bytes held by the highlighter."""
+        return (sys.getsizeof(self) + self.highlight_regions.nbytes +
+                getattr(self.regions, 'nbytes', 0))
+
     @classmethod
     def get_highlighter_for_view(cls, view):
         """Return the highlighter assigned to a view, or None."""
@@ -729,18 +2498,112 @@ class Highlight(EntitySelector):
         """
         return []
 
-    def add_highlight_regions(self):
+    def get_highlight_regions_in_region(self, region):
+        """
+        Return a list of the regions to highlight that begin within the given
+        region.
+
+        This is used to rescan part of the buffer. The default implementation
+        searches the region with highlight_pattern if there is one.
+        Otherwise the result of get_highlight_regions is stored in a
+        RegionIndex and looked up, so the whole file is scanned at most once
+        per change to the buffer however many chunks progressive
+        highlighting scans. Incremental highlighting is only used by
+        subclasses with a pattern or overriding this with a scan limited to
+        the region.
+
+        """
+        snapshot = self.get_buffer_snapshot()
+        pattern = self.highlight_pattern()
+        if pattern is not None:
+            return self.search_snapshot(pattern, snapshot, region)
+
+        full_scan = self._full_scan
+        if (full_scan is None) or (full_scan[0] != snapshot.change_count):
+            full_scan = self._full_scan = (
+                snapshot.change_count,
+                RegionIndex(self.get_highlight_regions()))
+        return full_scan[1].regions_beginning_within(region.begin(),
+                                                     region.end())
+
+    def add_highlight_regions(self, changed=None):
         """Add the highlight regions to the view.
 
+        The regions are drawn under a region key for each range in
+        _drawn_ranges. If changed is given as a list of (begin, end) ranges,
+        only the keys covering them are drawn again; otherwise the regions
+        are divided into new ranges and all of them are drawn.
+
         Also displays the status message.
 
         """
-        self.view.add_regions('entity_select_highlight',
-                              self.highlight_regions,
-                              'string',
+        if (changed is None) or not self._drawn_ranges:
+            self.erase_drawn_ranges()
+            regions = self.highlight_regions
+            size = self.HighlightKeySize
+            self._drawn_ranges = [
+                [0 if i == 0 else regions[i].begin(), self.new_region_key()]
+                for i in range(0, max(len(regions), 1), size)]
+            indexes = range(len(self._drawn_ranges))
+        else:
+            begins = [r[0] for r in self._drawn_ranges]
+            indexes = set()
+            for begin, end in changed:
+                first = bisect.bisect_right(begins, begin) - 1
+                while (first > 0) and (begins[first - 1] == begins[first]):
+                    first -= 1
+                indexes.update(range(max(first, 0),
+                                     bisect.bisect_right(begins, end)))
+
+        # Draw from the end, so splitting a range leaves the indexes of the
+        # ranges before it unchanged
+        for i in sorted(indexes, reverse=True):
+            self.draw_range(i)
+        Highlight.display_status_string(view=self.view, highlighter=self)
+
+    def draw_range(self, i):
+        """Draw the highlight regions in the range at index i of
+        _drawn_ranges.
+
+        Ranges holding too many regions are split, and empty ranges other
+        than the first are removed.
+
+        """
+        ranges = self._drawn_ranges
+        begin, key = ranges[i]
+        end = ranges[i + 1][0] - 1 if i + 1 < len(ranges) else sys.maxsize
+        regions = self.highlight_regions.regions_beginning_within(begin, end)
+        size = self.HighlightKeySize
+        if (not regions) and (i > 0):
+            self.view.erase_regions(key)
+            del ranges[i]
+            return
+        elif len(regions) > 2 * size:
+            pieces = [regions[j:j + size]
+                      for j in range(0, len(regions), size)]
+            ranges[i + 1:i + 1] = [[piece[0].begin(), self.new_region_key()]
+                                   for piece in pieces[1:]]
+            for j, piece in enumerate(pieces):
+                self.add_region_key(ranges[i + j][1], piece)
+            return
+        self.add_region_key(key, regions)
+
+    def add_region_key(self, key, regions):
+        self.view.add_regions(key, regions, 'string',
                               'Packages/EntitySelect/icons/highlight.png',
                               sublime.DRAW_NO_FILL)
-        Highlight.display_status_string(view=self.view, highlighter=self)
+
+    @staticmethod
+    def new_region_key():
+        """Return a region key not yet used by any highlighter."""
+        Highlight.DrawnKeyCount += 1
+        return 'entity_select_highlight.%d' % Highlight.DrawnKeyCount
+
+    def erase_drawn_ranges(self):
+        """Erase the region keys of the drawn ranges."""
+        for begin, key in self._drawn_ranges:
+            self.view.erase_regions(key)
+        self._drawn_ranges = []
 
     def erase_highlight_regions(self):
         """Remove the highlight regions from the view.
@@ -748,7 +2611,7 @@ class Highlight(EntitySelector):
         Also removes the status message.
 
         """
-        self.view.erase_regions('entity_select_highlight')
+        self.erase_drawn_ranges()
         self.view.erase_status(Highlight.STATUS_KEY)
 
     def move_to_highlight(self, forward=True):
@@ -762,30 +2625,80 @@ class Highlight(EntitySelector):
         """
         selection = self.view.sel()
         sel = selection[0]
+        if self.highlight_in_progress():
+            if forward:
+                self.ensure_scanned_after(sel.end())
+            else:
+                self.ensure_scanned_before(sel.begin())
         regions = self.highlight_regions
-        regions.sort()
-        next_ = regions[0]
-        prev = regions[-1]
-        begin = sel.begin()
-        end = sel.end()
-
-        for r in regions:
-            if r.end() <= begin:
-                prev = r
-            elif r.begin() >= end:
-                next_ = r
-                break
-
-        selection.clear()
         if forward:
-            selection.add(next_)
+            region = regions.next_after(sel.end())
         else:
-            selection.add(prev)
-        self.view.show(selection[0], True)
+            region = regions.previous_before(sel.begin())
+        if region is None:
+            sublime.status_message('No highlighted regions')
+            return
+
+        selection.clear()
+        selection.add(region)
+        self.view.show(region, True)
+
+    def ensure_scanned_after(self, point):
+        """Scan the view from point until the next highlight region is known.
+
+        If there is none, the beginning of the view is scanned for wrapping
+        around.
+
+        """
+        regions = self.highlight_regions
+
+        def found_after(boundary):
+            following = regions.next_after(point)
+            return ((following is not None) and
+                    (point <= following.begin() < boundary))
+
+        self.ensure_scanned(point, self.view.size(), stop=found_after)
+        if not found_after(self.view.size() + 1):
+            self.ensure_scanned(
+                0, point,
+                stop=lambda b: bool(regions) and (regions[0].begin() < b))
+
+    def ensure_scanned_before(self, point):
+        """Scan the view backwards from point until the previous highlight
+        region is known.
+
+        If there is none, the end of the view is scanned for wrapping around.
+
+        """
+        regions = self.highlight_regions
+
+        def found_before(boundary):
+            previous = regions.previous_before(point)
+            return ((previous is not None) and (previous.end() <= point) and
+                    (previous.begin() > boundary))
+
+        self.ensure_scanned(0, point, reverse=True, stop=found_before)
+        if not found_before(-1):
+            self.ensure_scanned(
+                point, self.view.size(), reverse=True,
+                stop=lambda b: bool(regions) and (regions[-1].begin() > b))
 
     def select_all_highlights(self):
-        """Selects all the highlighted regions."""
+        """Selects all the highlighted regions.
+
+        If the view is still being scanned, the regions are selected on the
+        main thread once the scan has finished.
+
+        """
+        if self.highlight_in_progress():
+            sublime.status_message('Scanning for highlights...')
+        self.when_highlight_complete(
+            lambda: sublime.set_timeout(self.select_highlight_regions, 0))
+
+    def select_highlight_regions(self):
         regions = self.highlight_regions
+        if not regions:
+            return
         sel = self.view.sel()
         sel.clear()
         sel.add_all(regions)
@@ -799,6 +2712,24 @@ class Highlight(EntitySelector):
         return '%s: %s' % (self.view.rowcol(reg.begin())[0] + 1,
                            self.view.substr(self.view.line(reg)))
 
+    def get_display_regions(self, regions):
+        """
+        Return a list of strings to display in the palette list for regions.
+
+        Rows and line text are looked up in the line index of a buffer
+        snapshot. Subclasses overriding get_display_region get one call per
+        region instead.
+
+        """
+        if (type(self).get_display_region is not
+                Highlight.get_display_region):
+            return [self.get_display_region(r) for r in regions]
+
+        snapshot = self.get_buffer_snapshot()
+        return ['%s: %s' % (snapshot.row(r.begin()) + 1,
+                            snapshot.line_text(r.begin(), r.end()))
+                for r in regions]
+
     @staticmethod
     def display_status_string(view=None, highlighter=None, **kwargs):
         """
@@ -812,17 +2743,16 @@ class Highlight(EntitySelector):
                 highlighter = Highlight.get_highlighter_for_view(view)
             if (highlighter is not None):
                 logger.debug("highlighter: %s", highlighter)
-                hr = highlighter.get_highlight_regions()
-                sel = view.sel()[0]
-                current = None
-                for i, r in enumerate(hr, start=1):
-                    if r.intersects(sel):
-                        current = i
-                        break
+                hr = highlighter.highlight_regions
+                current = hr.first_intersecting(view.sel()[0])
+                if current is not None:
+                    current += 1
                 logger.debug('current = %s', current)
-                view.set_status(Highlight.STATUS_KEY,
-                                highlighter.highlight_status_message(
-                                    len(hr), selection=current))
+                message = highlighter.highlight_status_message(
+                    len(hr), selection=current)
+                if highlighter.highlight_in_progress():
+                    message += ' (scanning)'
+                view.set_status(Highlight.STATUS_KEY, message)
             else:
                 view.erase_status(Highlight.STATUS_KEY)
 
@@ -833,12 +2763,97 @@ class PreemptiveHighlight(Highlight):
     # the preemptive_highlight_id().
     PreemptiveHighlighters = dict()
 
+    # Classes that have been logged as skipped by enable_for_regions.
+    SkippedLegacyClasses = set()
+
     @classmethod
     @abstractmethod
     def get_preemptive_highlight_selection(cls, view):
         """Return a region to enable a highlight."""
         pass
 
+    @classmethod
+    def get_preemptive_highlight_targets(cls, view):
+        """Return a list of the regions to highlight preemptively.
+
+        By default, this is the result of get_preemptive_highlight_selection.
+
+        """
+        targets = cls.get_preemptive_highlight_selection(view)
+        if not targets:
+            return []
+        elif isinstance(targets, sublime.Region):
+            return [targets]
+        return list(targets)
+
+    @classmethod
+    def enable_for_regions(cls, view, regions):
+        """Returns the keyword arguments used to create a highlighter for the
+        given target regions, or a false value if none should be created.
+
+        All targets are passed in one call, so subclasses can override this
+        to work out the highlight for all of them at once. By default,
+        enable_for_region is called with the first target, without touching
+        the view's selection, and all the targets are passed on to the
+        highlighter as target_regions.
+
+        Subclasses overriding enable_for_selection must also override
+        enable_for_region to be highlighted preemptively, since their
+        enable_for_selection reads the view's selection rather than the
+        targets. Otherwise they are skipped, and a warning is logged once.
+
+        """
+        if ((cls.enable_for_region.__func__ is
+                EntitySelector.enable_for_region.__func__) and
+                (cls.enable_for_selection.__func__ is not
+                 EntitySelector.enable_for_selection.__func__)):
+            if cls not in PreemptiveHighlight.SkippedLegacyClasses:
+                PreemptiveHighlight.SkippedLegacyClasses.add(cls)
+                logger.warning(
+                    '%s overrides enable_for_selection but not '
+                    'enable_for_region, so it is not highlighted '
+                    'preemptively. Override enable_for_region to enable it.',
+                    cls.__name__)
+            return None
+
+        enabled = cls.enable_for_region(view, regions[0])
+        if not enabled:
+            return enabled
+        kwargs = dict(enabled)
+        kwargs.setdefault('target_regions', regions)
+        return kwargs
+
+    @classmethod
+    def preemptive_highlight(cls, view, on_done=None):
+        """Highlight the preemptive targets in the view.
+
+        The selector assigned to the view is left unchanged. Returns the new
+        highlighter, or None if there is nothing to highlight.
+
+        Keyword arguments:
+        on_done - passed on to highlight
+
+        """
+        targets = cls.get_preemptive_highlight_targets(view)
+        if not targets:
+            return None
+
+        enabled = cls.enable_for_regions(view, targets)
+        if not enabled:
+            return None
+
+        kwargs = dict(enabled)
+        if issubclass(cls, DocLink):
+            # The targets are not the selection, so it must not be checked
+            kwargs.setdefault('check_selection', False)
+
+        current_selector = EntitySelector.get_selector_for_view(view)
+        highlighter = cls(view, **kwargs)
+        EntitySelector.update_selector_for_view(view, current_selector)
+
+        highlighter.highlight(on_done=on_done)
+        return highlighter
+
     @classmethod
     def add_possible_selector(cls):
         """Adds the given class to the list of Possible EntitySelectors."""
@@ -892,22 +2907,88 @@ class StatusIdentifier(EntitySelector):
 
     StatusKey = '_status_identifier'
 
+    # Status strings computed on the status worker pool, keyed by the tuple
+    # returned by status_cache_key.
+    StatusStringCache = LRUCache(256)
+
     def __init__(self, view, status_string = None, **kwargs):
         super(StatusIdentifier, self).__init__(view, **kwargs)
         self.status_string = status_string
+        self._status_regions = tuple((r.a, r.b) for r in self.regions)
 
     @property
     def status_string(self):
         """Returns the string to display in the status bar.
 
-        This is done as a property so it can be computed if desired.
+        This is done as a property so it can be computed if desired. The
+        status string may be given as a callable taking no arguments, which
+        is called on a worker thread when the status string is displayed.
+        Until it has been computed, the status string is None.
 
         """
+        if self.has_lazy_status_string():
+            return StatusIdentifier.StatusStringCache.get(
+                self.status_cache_key(), None, count=False)
         return self._status_string
     @status_string.setter
     def status_string(self, value):
         self._status_string = value
 
+    def has_lazy_status_string(self):
+        """Returns True if the status string is computed by a callable."""
+        return callable(self._status_string)
+
+    def status_cache_key(self):
+        """Returns the key used to memoize a computed status string.
+
+        By default, this is the class, the entity and the version of the
+        buffer. The entity is the search string if the selector has one, or
+        the regions the selector was created for.
+
+        """
+        entity = getattr(self, 'search_string', None)
+        if entity is None:
+            entity = self._status_regions
+        return (type(self), entity, self.view.buffer_id(),
+                self.view.change_count())
+
+    @classmethod
+    def get_status_pool(cls):
+        """Returns the WorkerPool used to compute status strings."""
+        return worker_pool('StatusString', 'status_worker_threads')
+
+    def request_status_string(self):
+        """Displays the lazy status string, computing it on the status
+        worker pool unless it is memoized.
+
+        """
+        key = self.status_cache_key()
+        value = StatusIdentifier.StatusStringCache.get(key)
+        if value is not LRUCache.MISSING:
+            self.publish_status_string(value)
+            return
+
+        def done(value):
+            StatusIdentifier.StatusStringCache.put(key, value)
+            self.publish_status_string(value)
+
+        StatusIdentifier.get_status_pool().submit(
+            self.view.id(), self._status_string, done)
+
+    def publish_status_string(self, value):
+        """Shows value in the status bar if the selector is still assigned to
+        the view.
+
+        """
+        if ((value is not None) and
+                (EntitySelector.get_selector_for_view(self.view) is self)):
+            self.view.set_status(StatusIdentifier.StatusKey, value)
+
+    @staticmethod
+    def cancel_status_string(view_id):
+        """Cancels the status string being computed for a view."""
+        cancel_worker_job('StatusString', view_id)
+
     @staticmethod
     def display_status_string(view=None, selector=None, **kwargs):
         """
@@ -919,8 +3000,11 @@ class StatusIdentifier(EntitySelector):
 
         if ((view is not None) and (selector is not None) and
                 isinstance(selector, StatusIdentifier)):
-            if (selector.enable_status_string() and
-                    (selector.status_string is not None)):
+            if not selector.enable_status_string():
+                return
+            elif selector.has_lazy_status_string():
+                selector.request_status_string()
+            elif selector.status_string is not None:
                 view.set_status(StatusIdentifier.StatusKey,
                                 selector.status_string)
 
@@ -933,21 +3017,217 @@ class StatusIdentifier(EntitySelector):
         """
         if view is not None:
             view.erase_status(StatusIdentifier.StatusKey)
+            StatusIdentifier.cancel_status_string(view.id())
 
     def enable_status_string(self):
         return True
 
+    def clear_view(self):
+        super(StatusIdentifier, self).clear_view()
+        self.view.erase_status(StatusIdentifier.StatusKey)
+
 
 class ViewData(object):
     """Stores data for a view."""
 
+    # Maximum number of points with a cached scope name for a view
+    MAX_CACHED_SCOPE_NAMES = 1024
+
+    # Points closer together than this are resolved by scope_names_at with a
+    # single call to extract_tokens_with_scopes, where available
+    SCOPE_BATCH_GAP = 128
+
+    # Maximum number of recorded changes applied to patch a buffer snapshot.
+    # Beyond this, copying the text from the view again is cheaper.
+    MAX_PATCHED_CHANGES = 32
+
     def __init__(self, view, selector = None):
         super(ViewData, self).__init__()
         self.id = view.id()
         self.scope = ViewData.scope_from_view(view)
         self.selector = selector
+
+        # Scope names keyed by (change count, point). They are cleared when
+        # the view's syntax changes, which leaves the change count as is.
+        self.change_count = None
+        self.syntax = None
+        self.scope_names = dict()
+
+        # Selector scores keyed by (scope name, scope selector)
+        self.scope_scores = dict()
+
+        # BufferSnapshot of the view's text, created when first needed
+        self.snapshot = None
+
+        # Changes made to the buffer since the snapshot was taken, as
+        # (change count, [(begin, end, text)]) tuples
+        self.snapshot_changes = []
+        self.snapshot_lock = threading.Lock()
+
+        self.update_change_count(view)
         self.update_possible_selectors(view)
 
+    def update_change_count(self, view):
+        """Clears the cached scopes if the view's buffer or syntax has
+        changed.
+
+        """
+        change_count = view.change_count()
+        syntax = view.settings().get('syntax')
+        if (self.change_count != change_count) or (self.syntax != syntax):
+            self.change_count = change_count
+            self.syntax = syntax
+            self.scope_names = dict()
+            self.scope_scores = dict()
+
+    def scope_name(self, view, point):
+        """Returns the scope name at the given point in the view.
+
+        The scope name is cached until the view's buffer or syntax changes.
+
+        """
+        key = (self.change_count, point)
+        try:
+            return self.scope_names[key]
+        except KeyError:
+            if len(self.scope_names) >= ViewData.MAX_CACHED_SCOPE_NAMES:
+                self.scope_names = dict()
+            scope = self.scope_names[key] = view.scope_name(point)
+            return scope
+
+    def scope_names_at(self, view, points):
+        """Returns a dictionary of the scope names at the given points in
+        the view, keyed by point.
+
+        The points are resolved in one pass, and cached like scope_name.
+        Where the API provides extract_tokens_with_scopes, the uncached
+        points are split into spans of nearby points and each span is
+        resolved with a single call. Otherwise scope_name is called once for
+        each distinct uncached point.
+
+        """
+        result = dict()
+        missing = []
+        for point in set(points):
+            try:
+                result[point] = self.scope_names[(self.change_count, point)]
+            except KeyError:
+                missing.append(point)
+        if not missing:
+            return result
+
+        if (len(self.scope_names) + len(missing) >
+                ViewData.MAX_CACHED_SCOPE_NAMES):
+            self.scope_names = dict()
+        missing.sort()
+        if hasattr(view, 'extract_tokens_with_scopes'):
+            start = 0
+            for i in range(1, len(missing) + 1):
+                if ((i == len(missing)) or
+                        (missing[i] - missing[i - 1] > self.SCOPE_BATCH_GAP)):
+                    span = missing[start:i]
+                    self.add_token_scopes(
+                        view, sublime.Region(span[0], span[-1] + 1), span,
+                        result)
+                    start = i
+        for point in missing:
+            if point not in result:
+                result[point] = view.scope_name(point)
+            self.scope_names[(self.change_count, point)] = result[point]
+        return result
+
+    def add_token_scopes(self, view, region, points, result):
+        """Adds the scope names of the points within region to result, from
+        a single call to extract_tokens_with_scopes.
+
+        """
+        tokens = view.extract_tokens_with_scopes(region)
+        i = 0
+        for point in points:
+            while (i < len(tokens)) and (tokens[i][0].end() <= point):
+                i += 1
+            if (i < len(tokens)) and (tokens[i][0].begin() <= point):
+                result[point] = tokens[i][1]
+
+    def buffer_snapshot(self, view):
+        """Returns a BufferSnapshot of the view's text.
+
+        The snapshot is reused until the view's buffer changes. It is then
+        patched with the recorded changes if they lead up to the current
+        change count, and copied from the view again otherwise.
+
+        """
+        with self.snapshot_lock:
+            snapshot = self.snapshot
+            recorded = list(self.snapshot_changes)
+        change_count = view.change_count()
+        if (snapshot is not None) and (snapshot.change_count == change_count):
+            return snapshot
+
+        if (snapshot is not None) and recorded and (
+                recorded[-1][0] == change_count):
+            changes = [change for count, batch in recorded
+                       if count > snapshot.change_count for change in batch]
+            if len(changes) <= ViewData.MAX_PATCHED_CHANGES:
+                patched = snapshot.apply_changes(changes, change_count)
+                if len(patched) == view.size():
+                    self.set_snapshot(patched)
+                    return patched
+
+        while (snapshot is None) or (snapshot.change_count != change_count):
+            text = view.substr(sublime.Region(0, view.size()))
+            if view.change_count() == change_count:
+                snapshot = BufferSnapshot(text, change_count)
+                self.set_snapshot(snapshot)
+            else:
+                change_count = view.change_count()
+        return snapshot
+
+    def set_snapshot(self, snapshot):
+        """Stores a buffer snapshot, discarding the changes it includes."""
+        with self.snapshot_lock:
+            self.snapshot = snapshot
+            self.snapshot_changes = [
+                c for c in self.snapshot_changes
+                if c[0] > snapshot.change_count]
+
+    def record_text_changes(self, change_count, changes):
+        """Records changes to the buffer made since the snapshot was taken.
+
+        Keyword arguments:
+        change_count - the change count of the buffer after the changes
+        changes - a list of (begin, end, text) tuples, one for each change
+
+        """
+        with self.snapshot_lock:
+            if self.snapshot is not None:
+                self.snapshot_changes.append((change_count, changes))
+
+    def score_selection_scope(self, view, cls, point):
+        """Returns the score of the selection scope of an EntitySelector class
+        at the given point in the view.
+
+        Scores are cached by the scope name at the point, so repeated checks
+        within a single token do not need to score the selector again.
+
+        """
+        return self.score_scope(self.scope_name(view, point),
+                                cls.scope_selection_enabler())
+
+    def score_scope(self, scope, selector):
+        """Returns the score of a scope selector against a scope name.
+
+        Scores are cached until the view's buffer changes.
+
+        """
+        key = (scope, selector)
+        try:
+            return self.scope_scores[key]
+        except KeyError:
+            score = self.scope_scores[key] = sublime.score_selector(
+                scope, selector)
+            return score
+
     def get_possible_selectors_for_view(self, view):
         """Returns a list of possible EntitySelector classes for a view.
 
@@ -957,19 +3237,63 @@ class ViewData(object):
 
         """
         scope = ViewData.scope_from_view(view)
-        hash_ = ViewData.get_possible_selectors_hash()
-        if ((self.scope != scope) or
-                (self.possible_selectors_hash != hash_)):
+        if self.scope != scope:
             self.scope = scope
+            self.scope_names = dict()
+            self.update_possible_selectors(view)
+        elif self.registry_version != EntitySelector.RegistryVersion:
             self.update_possible_selectors(view)
 
         return self.possible_selectors
 
     def update_possible_selectors(self, view):
-        self.possible_selectors_hash = ViewData.get_possible_selectors_hash()
-        self.possible_selectors = [s for s in EntitySelector.PossibleSelectors
-                                   if ((s.check_scope_for_view(view) > 0)
-                                       and s.enable_for_view(view))]
+        self.scope_scores = dict()
+        self.registry_version = EntitySelector.RegistryVersion
+        self.possible_selectors = [
+            s for s in EntitySelector.PossibleSelectors
+            if ((s.profile_call('check_scope_for_view',
+                                s.check_scope_for_view, view) > 0)
+                and s.enable_for_view(view))]
+        self.scope_index = ScopeIndex(
+            (s, ViewData.indexable_selection_enabler(s))
+            for s in self.possible_selectors)
+
+    @staticmethod
+    def indexable_selection_enabler(cls):
+        """Returns the scope selector used to index an EntitySelector class.
+
+        Classes overriding check_scope_for_selection may score selections
+        without their scope_selection_enabler, so they are not indexed and
+        are checked for every selection.
+
+        """
+        if (cls.check_scope_for_selection.__func__ is not
+                EntitySelector.check_scope_for_selection.__func__):
+            return None
+        return cls.scope_selection_enabler()
+
+    def candidate_selectors(self, scope):
+        """Returns the possible selectors that may match the scope name.
+
+        The selectors are returned in the order they were registered.
+
+        """
+        return self.scope_index.candidates(scope)
+
+    def estimated_size(self):
+        """Returns the approximate number of bytes held by the view data.
+
+        This includes the cached scopes and buffer snapshot, and the regions
+        of the view's selector.
+
+        """
+        size = (sys.getsizeof(self) + sys.getsizeof(self.scope_names) +
+                sys.getsizeof(self.scope_scores))
+        if self.snapshot is not None:
+            size += sys.getsizeof(self.snapshot.text)
+        if self.selector is not None:
+            size += getattr(self.selector.regions, 'nbytes', 0)
+        return size
 
     @staticmethod
     def scope_from_view(view):
@@ -981,15 +3305,15 @@ class ViewData(object):
 
         return scope.split(' ')[0]
 
-    @staticmethod
-    def get_possible_selectors_hash():
-        hash_list = [c.UniqueKey() for c in EntitySelector.PossibleSelectors]
-        return hash(str(hash_list))
-
 
 DocLink.add_on_before_check_callback(DocLink.erase_regions)
 DocLink.add_on_after_check_callback(DocLink.add_regions)
 
+EntitySelector.add_on_view_released_callback(DocLink.cancel_prefetch)
+EntitySelector.add_on_view_released_callback(Highlight.release_highlighter)
+EntitySelector.add_on_view_released_callback(
+    StatusIdentifier.cancel_status_string)
+
 Highlight.add_on_after_check_callback(Highlight.display_status_string)
 
 StatusIdentifier.add_on_before_check_callback(StatusIdentifier.erase_status_string)
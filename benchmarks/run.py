@@ -0,0 +1,288 @@
+"""Headless benchmarks for the EntitySelect matching pipeline.
+
+The package is loaded against the stand-in sublime modules in this folder,
+and each benchmark is timed per event across combinations of file size,
+number of registered selectors and number of carets. Latency percentiles
+and the number of view API calls per event are reported.
+
+Usage:
+    python benchmarks/run.py [--lines 1000 10000] [--selectors 1 20]
+                             [--carets 1 10] [--events 200] [--warmup 20]
+                             [--benchmarks match_entity highlight]
+
+Each benchmark runs on a new view, so caches warmed by one benchmark do not
+affect the next. The warm-up events are not included in the statistics.
+
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import sublime
+
+
+def load_package():
+    """Imports the package as EntitySelect, with its Commands module."""
+    for name, path in (('EntitySelect', '__init__.py'),
+                       ('EntitySelect.Commands', 'Commands.py')):
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(PACKAGE_DIR, path),
+            submodule_search_locations=(
+                [PACKAGE_DIR] if name == 'EntitySelect' else None))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules['EntitySelect']
+
+
+ES = load_package()
+
+# Scope selectors given to the generated selectors in turn
+SELECTION_SCOPES = ['variable.other', 'constant.numeric',
+                    'string.quoted', 'keyword.control',
+                    'comment.line', 'source.python variable.other']
+
+
+def generate_text(lines, seed=0):
+    """Returns Python-like source with the given number of lines."""
+    rng = random.Random(seed)
+    names = ['name_%d' % i for i in range(max(10, lines // 20))]
+    templates = [
+        'def {0}({1}):',
+        '    {0} = {1} + {2}',
+        '    return {0}("{1}")  # uses {2}',
+        'if {0} and not {1}:',
+        '    {0}.append({2})',
+    ]
+    result = []
+    for i in range(lines):
+        template = templates[i % len(templates)]
+        result.append(template.format(rng.choice(names), rng.choice(names),
+                                      rng.randint(0, 1000)))
+    return '\n'.join(result) + '\n'
+
+
+def word_at(text, point):
+    """Returns the region of the word at point."""
+    begin = end = point
+    while (begin > 0) and (text[begin - 1].isalnum() or text[begin - 1] == '_'):
+        begin -= 1
+    while (end < len(text)) and (text[end].isalnum() or text[end] == '_'):
+        end += 1
+    return sublime.Region(begin, end)
+
+
+def make_selectors(count):
+    """Returns count generated selector classes.
+
+    The first is a Highlight matching identifiers. The rest are
+    StatusIdentifiers whose scope selectors cycle through SELECTION_SCOPES,
+    half of which decline the selection in enable_for_selection.
+
+    """
+    class BenchHighlight(ES.Highlight, ES.StatusIdentifier):
+        @classmethod
+        def scope_view_enabler(cls):
+            return 'source.python'
+
+        @classmethod
+        def scope_selection_enabler(cls):
+            return 'variable.other'
+
+        @classmethod
+        def enable_for_selection(cls, view):
+            region = word_at(view.text, view.sel()[0].begin())
+            return {'search_region': region,
+                    'status_string': 'Entity ' + view.substr(region)}
+
+        def get_highlight_regions(self):
+            return self.view.find_all(r'\b%s\b' % self.search_string)
+
+    selectors = [BenchHighlight]
+    for i in range(1, count):
+        def enable_for_selection(cls, view, accept=(i % 2 == 0)):
+            if not accept:
+                return False
+            return {'status_string': cls.__name__}
+
+        selectors.append(type('BenchSelector%d' % i, (ES.StatusIdentifier,), {
+            'scope_view_enabler': classmethod(lambda cls: 'source.python'),
+            'scope_selection_enabler': classmethod(
+                lambda cls, s=SELECTION_SCOPES[i % len(SELECTION_SCOPES)]: s),
+            'enable_for_selection': classmethod(enable_for_selection),
+        }))
+    # Register the catch-all highlighter last so the others are considered
+    return selectors[1:] + selectors[:1]
+
+
+def register_selectors(selector_count):
+    """Replaces the possible selectors with selector_count new ones."""
+    ES.EntitySelector.remove_possible_selectors(
+        list(ES.EntitySelector.PossibleSelectors))
+    ES.EntitySelector.add_possible_selectors(make_selectors(selector_count))
+
+
+def new_view(text):
+    """Returns a new view of text, discarding the state of previous views."""
+    for view_id in list(ES.EntitySelector.ViewSelectors):
+        ES.EntitySelector.release_view(view_id)
+    ES.EntitySelector.ViewSelectors.clear()
+    ES.Highlight.Highlighters.clear()
+    sublime.run_timeouts()
+
+    window = sublime.active_window()
+    view = sublime.View(text)
+    window._views = []
+    window.add_view(view)
+    view.sel().add(sublime.Region(0))
+    return view
+
+
+def random_carets(view, rng, count):
+    """Moves count carets to random points in the view."""
+    size = len(view.text)
+    points = sorted(rng.randrange(size) for i in range(count))
+    view.sel().clear()
+    view.sel().add_all(sublime.Region(p) for p in points)
+
+
+def drain(done):
+    """Runs queued timeouts until done() returns True."""
+    while not done():
+        if not sublime.run_timeouts():
+            time.sleep(0.0005)
+
+
+def bench_match_entity(view, rng, carets):
+    random_carets(view, rng, carets)
+    return lambda: ES.EntitySelector.match_entity(view)
+
+
+def bench_check_regions(view, rng, carets):
+    random_carets(view, rng, carets)
+    return lambda: ES.EntitySelector.check_regions(view)
+
+
+def bench_sorted_selectors_for_selection(view, rng, carets):
+    random_carets(view, rng, carets)
+    return lambda: ES.EntitySelector.sorted_selectors_for_selection(view)
+
+
+def bench_highlight(view, rng, carets):
+    random_carets(view, rng, 1)
+    region = word_at(view.text, view.sel()[0].begin())
+    while region.empty():
+        random_carets(view, rng, 1)
+        region = word_at(view.text, view.sel()[0].begin())
+    highlighter = ES.Highlight.get_highlighter_for_view(view)
+    if highlighter is not None:
+        highlighter.remove_highlighter_from_view()
+    cls = ES.EntitySelector.PossibleSelectors[-1]
+    highlighter = cls(view, search_region=region)
+
+    def run():
+        finished = []
+        highlighter.highlight(on_done=finished.append)
+        drain(lambda: finished)
+    return run
+
+
+BENCHMARKS = [
+    ('match_entity', bench_match_entity),
+    ('check_regions', bench_check_regions),
+    ('sorted_selectors_for_selection', bench_sorted_selectors_for_selection),
+    ('highlight', bench_highlight),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Returns the given percentile of a sorted list, by nearest rank."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_benchmark(prepare, view, rng, carets, events, warmup=0):
+    """Times events calls of the function returned by prepare.
+
+    The first warmup calls are made without being timed. Returns a sorted
+    list of durations in milliseconds and the mean number of API calls per
+    event.
+
+    """
+    for i in range(warmup):
+        prepare(view, rng, carets)()
+        sublime.run_timeouts()
+
+    durations = []
+    api_calls = 0
+    for i in range(events):
+        event = prepare(view, rng, carets)
+        view.api_calls = 0
+        start = time.perf_counter()
+        event()
+        durations.append((time.perf_counter() - start) * 1000)
+        api_calls += view.api_calls
+        sublime.run_timeouts()
+    durations.sort()
+    return durations, api_calls / events
+
+
+HEADER = ('%-32s %7s %5s %6s %9s %9s %9s %9s %9s' %
+          ('benchmark', 'lines', 'sel', 'carets', 'p50 ms', 'p90 ms',
+           'p99 ms', 'max ms', 'api/evt'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, nargs='+',
+                        default=[1000, 10000, 50000])
+    parser.add_argument('--selectors', type=int, nargs='+',
+                        default=[1, 10, 50])
+    parser.add_argument('--carets', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--benchmarks', nargs='+',
+                        choices=[name for name, f in BENCHMARKS],
+                        default=[name for name, f in BENCHMARKS])
+    args = parser.parse_args(argv)
+
+    print(HEADER)
+    for lines in args.lines:
+        text = generate_text(lines, args.seed)
+        for selector_count in args.selectors:
+            register_selectors(selector_count)
+            for name, prepare in BENCHMARKS:
+                if name not in args.benchmarks:
+                    continue
+                caret_counts = [1] if name == 'highlight' else args.carets
+                for carets in caret_counts:
+                    # Each benchmark visits its own caret positions
+                    rng = random.Random('%s:%s:%s:%s:%s' % (
+                        args.seed, name, lines, selector_count, carets))
+                    durations, api_calls = run_benchmark(
+                        prepare, new_view(text), rng, carets, args.events,
+                        args.warmup)
+                    print('%-32s %7d %5d %6d %9.3f %9.3f %9.3f %9.3f %9.1f' % (
+                        name, lines, selector_count, carets,
+                        percentile(durations, 0.5),
+                        percentile(durations, 0.9),
+                        percentile(durations, 0.99),
+                        durations[-1], api_calls))
+                    sys.stdout.flush()
+
+    ES.shutdown_worker_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+"""Stand-in for the sublime module used to run EntitySelect headless.
+
+Only the parts of the API used by EntitySelect are provided. Views hold
+their text in a string and scope names come from a simple tokenizer, so
+scores are not identical to Sublime's, but the code paths and the number of
+API calls are. Each View counts the API calls made on it in api_calls.
+
+"""
+import bisect
+import re
+import tempfile
+import threading
+
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_STIPPLED_UNDERLINE = 512
+HIDE_ON_MINIMAP = 128
+ENCODED_POSITION = 1
+TRANSIENT = 4
+
+_timeouts = []
+_timeouts_lock = threading.Lock()
+_settings = {}
+_cache_path = tempfile.mkdtemp(prefix='entity_select_bench_')
+
+
+def version():
+    return '3211'
+
+
+def set_timeout(callback, delay=0):
+    with _timeouts_lock:
+        _timeouts.append(callback)
+
+
+set_timeout_async = set_timeout
+
+
+def run_timeouts():
+    """Runs the queued timeout callbacks, ignoring their delays.
+
+    Returns the number of callbacks run.
+
+    """
+    count = 0
+    while True:
+        with _timeouts_lock:
+            if not _timeouts:
+                return count
+            callback = _timeouts.pop(0)
+        callback()
+        count += 1
+
+
+def status_message(msg):
+    pass
+
+
+def load_settings(name):
+    return _settings.setdefault(name, Settings())
+
+
+def cache_path():
+    return _cache_path
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def add_on_change(self, key, callback):
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        self.callbacks.pop(key, None)
+
+
+def _match_atom(atom, scope):
+    return scope == atom or scope.startswith(atom + '.')
+
+
+def _score_path(path, scopes):
+    score = 0
+    j = len(scopes) - 1
+    for atom in reversed(path):
+        while j >= 0 and not _match_atom(atom, scopes[j]):
+            j -= 1
+        if j < 0:
+            return 0
+        score += (j + 1) * 8 + atom.count('.') + 1
+        j -= 1
+    return score
+
+
+def score_selector(scope_name, selector):
+    """Scores a scope selector against a scope name.
+
+    Supports descendant paths, ',' and '|' alternatives and '-' exclusions.
+
+    """
+    scopes = scope_name.split()
+    best = 0
+    for alternative in re.split(r'[,|]', selector or ''):
+        parts = re.split(r'\s+-\s*', ' ' + alternative.strip())
+        path = parts[0].split()
+        if not path:
+            continue
+        score = _score_path(path, scopes)
+        if score and all(not _score_path(p.split(), scopes)
+                         for p in parts[1:]):
+            best = max(best, score)
+    return best
+
+
+class Region(object):
+    __slots__ = ('a', 'b', 'xpos')
+
+    def __init__(self, a, b=None, xpos=-1):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+        self.xpos = xpos
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def cover(self, other):
+        return Region(min(self.begin(), other.begin()),
+                      max(self.end(), other.end()))
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return x.begin() >= self.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, other):
+        lb, le = self.begin(), self.end()
+        rb, re_ = other.begin(), other.end()
+        return ((lb == rb and le == re_) or (lb < rb < le) or
+                (lb < re_ < le) or (rb < lb < re_) or (rb < le < re_))
+
+    def __eq__(self, other):
+        return (isinstance(other, Region) and
+                self.a == other.a and self.b == other.b)
+
+    def __lt__(self, other):
+        return self.begin() < other.begin()
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __len__(self):
+        return self.size()
+
+    def __repr__(self):
+        return '(%s, %s)' % (self.a, self.b)
+
+
+class Selection(object):
+    def __init__(self, view):
+        self.view = view
+        self.regions = []
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, index):
+        return self.regions[index]
+
+    def __iter__(self):
+        return iter(list(self.regions))
+
+    def clear(self):
+        self.regions = []
+
+    def add(self, region):
+        self.regions.append(region)
+        self.regions.sort(key=Region.begin)
+
+    def add_all(self, regions):
+        self.regions.extend(regions)
+        self.regions.sort(key=Region.begin)
+
+    def contains(self, region):
+        return any(r.contains(region) for r in self.regions)
+
+
+KEYWORDS = frozenset(('def', 'return', 'if', 'else', 'for', 'in', 'while',
+                      'class', 'import', 'from', 'and', 'or', 'not'))
+
+_TOKEN = re.compile(r'(?P<comment>#[^\n]*)|(?P<string>"[^"\n]*")'
+                    r'|(?P<word>[A-Za-z_]\w*)|(?P<number>\d+)'
+                    r'|(?P<punctuation>[^\w\s])|(?P<whitespace>\s+)')
+
+_SCOPES = {'comment': 'comment.line.number-sign',
+           'string': 'string.quoted.double',
+           'word': 'variable.other',
+           'number': 'constant.numeric',
+           'punctuation': 'punctuation.separator',
+           'whitespace': None}
+
+_view_ids = [0]
+
+
+class View(object):
+    """A view whose buffer is a string, with scopes from a tokenizer."""
+
+    def __init__(self, text='', syntax='source.python', file_name=None):
+        _view_ids[0] += 1
+        self._id = _view_ids[0]
+        self.text = text
+        self.syntax = syntax
+        self._sel = Selection(self)
+        self._settings = Settings()
+        self._regions = {}
+        self._status = {}
+        self._change_count = 0
+        self._file_name = file_name
+        self._window = None
+        self._tokens = None
+        self.api_calls = 0
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def file_name(self):
+        return self._file_name
+
+    def settings(self):
+        return self._settings
+
+    def window(self):
+        return self._window
+
+    def sel(self):
+        return self._sel
+
+    def is_loading(self):
+        return False
+
+    def size(self):
+        self.api_calls += 1
+        return len(self.text)
+
+    def change_count(self):
+        self.api_calls += 1
+        return self._change_count
+
+    def is_dirty(self):
+        return self._change_count > 0
+
+    def substr(self, x):
+        self.api_calls += 1
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x + 1]
+
+    def _tokenize(self):
+        if self._tokens is None:
+            self._tokens = []
+            for m in _TOKEN.finditer(self.text):
+                kind = m.lastgroup
+                if (kind == 'word') and (m.group() in KEYWORDS):
+                    scope = 'keyword.control'
+                else:
+                    scope = _SCOPES[kind]
+                self._tokens.append((m.start(), m.end(), scope))
+            self._token_starts = [t[0] for t in self._tokens]
+        return self._tokens
+
+    def scope_name(self, point):
+        self.api_calls += 1
+        tokens = self._tokenize()
+        i = bisect.bisect_right(self._token_starts, point) - 1
+        leaf = None
+        if (0 <= i < len(tokens)) and (tokens[i][0] <= point < tokens[i][1]):
+            leaf = tokens[i][2]
+        return self._scope(leaf)
+
+    def _scope(self, leaf):
+        if leaf:
+            return '%s %s.%s ' % (self.syntax, leaf,
+                                  self.syntax.split('.')[-1])
+        return self.syntax + ' '
+
+    def extract_tokens_with_scopes(self, region):
+        self.api_calls += 1
+        tokens = self._tokenize()
+        end = min(region.end(), len(self.text))
+        point = region.begin()
+        i = max(0, bisect.bisect_right(self._token_starts, point) - 1)
+        result = []
+        while point < end:
+            if (i < len(tokens)) and (tokens[i][1] <= point):
+                i += 1
+            elif (i < len(tokens)) and (tokens[i][0] <= point):
+                result.append((Region(tokens[i][0], tokens[i][1]),
+                               self._scope(tokens[i][2])))
+                point = tokens[i][1]
+                i += 1
+            else:
+                gap_end = tokens[i][0] if i < len(tokens) else len(self.text)
+                result.append((Region(point, gap_end), self._scope(None)))
+                point = gap_end
+        return result
+
+    def score_selector(self, point, selector):
+        return score_selector(self.scope_name(point), selector)
+
+    def find_all(self, pattern, flags=0):
+        self.api_calls += 1
+        return [Region(m.start(), m.end())
+                for m in re.finditer(pattern, self.text)]
+
+    def find(self, pattern, start, flags=0):
+        self.api_calls += 1
+        m = re.compile(pattern).search(self.text, start)
+        if m is None:
+            return Region(-1, -1)
+        return Region(m.start(), m.end())
+
+    def line(self, x):
+        self.api_calls += 1
+        if isinstance(x, Region):
+            begin, end = x.begin(), x.end()
+        else:
+            begin = end = x
+        begin = max(0, min(begin, len(self.text)))
+        end = max(0, min(end, len(self.text)))
+        start = self.text.rfind('\n', 0, begin) + 1
+        stop = self.text.find('\n', end)
+        if stop == -1:
+            stop = len(self.text)
+        return Region(start, stop)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.begin(), min(len(self.text), line.end() + 1))
+
+    def rowcol(self, point):
+        self.api_calls += 1
+        row = self.text.count('\n', 0, point)
+        col = point - (self.text.rfind('\n', 0, point) + 1)
+        return (row, col)
+
+    def text_point(self, row, col):
+        self.api_calls += 1
+        point = 0
+        for i in range(row):
+            point = self.text.index('\n', point) + 1
+        return point + col
+
+    def visible_region(self):
+        self.api_calls += 1
+        return Region(0, min(len(self.text), 4000))
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        self.api_calls += 1
+        self._regions[key] = list(regions)
+
+    def get_regions(self, key):
+        self.api_calls += 1
+        return list(self._regions.get(key, []))
+
+    def erase_regions(self, key):
+        self.api_calls += 1
+        self._regions.pop(key, None)
+
+    def set_status(self, key, value):
+        self.api_calls += 1
+        self._status[key] = value
+
+    def get_status(self, key):
+        return self._status.get(key, '')
+
+    def erase_status(self, key):
+        self.api_calls += 1
+        self._status.pop(key, None)
+
+    def show(self, *args, **kwargs):
+        self.api_calls += 1
+
+    def show_at_center(self, *args, **kwargs):
+        self.api_calls += 1
+
+    def viewport_position(self):
+        return (0, 0)
+
+    def set_viewport_position(self, *args, **kwargs):
+        self.api_calls += 1
+
+    def text_to_layout(self, point):
+        return (0, 0)
+
+    def run_command(self, cmd, args=None):
+        pass
+
+    def show_popup(self, content, **kwargs):
+        self.api_calls += 1
+
+    def set_read_only(self, value):
+        pass
+
+    def assign_syntax(self, syntax):
+        self._settings.set('syntax', syntax)
+
+    def replace_text(self, begin, end, text):
+        """Edits the buffer, as a stand-in for an edit command.
+
+        Regions added to the view are moved with the text, as Sublime does.
+
+        """
+        self.text = self.text[:begin] + text + self.text[end:]
+        self._change_count += 1
+        self._tokens = None
+
+        delta = len(text) - (end - begin)
+
+        def move(point):
+            if point >= end:
+                return point + delta
+            return min(point, begin)
+
+        for key, regions in self._regions.items():
+            self._regions[key] = [Region(move(r.a), move(r.b))
+                                  for r in regions]
+
+
+class Window(object):
+    def __init__(self):
+        self._views = []
+        self._panels = {}
+        self._folders = []
+
+    def id(self):
+        return 1
+
+    def views(self):
+        return list(self._views)
+
+    def add_view(self, view):
+        view._window = self
+        self._views.append(view)
+
+    def active_view(self):
+        return self._views[-1] if self._views else None
+
+    def num_groups(self):
+        return 1
+
+    def active_view_in_group(self, group):
+        return self.active_view()
+
+    def folders(self):
+        return list(self._folders)
+
+    def create_output_panel(self, name):
+        self._panels[name] = View('', 'text.plain')
+        return self._panels[name]
+
+    def find_output_panel(self, name):
+        return self._panels.get(name)
+
+    def run_command(self, *args, **kwargs):
+        pass
+
+    def show_quick_panel(self, items, *args, **kwargs):
+        pass
+
+    def open_file(self, *args, **kwargs):
+        return View()
+
+
+_window = Window()
+
+
+def active_window():
+    return _window
+
+
+def windows():
+    return [_window]
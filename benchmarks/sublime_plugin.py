@@ -0,0 +1,28 @@
+"""Stand-in for the sublime_plugin module used to run EntitySelect headless."""
+
+
+class EventListener(object):
+    pass
+
+
+class ViewEventListener(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class TextChangeListener(object):
+    pass
+
+
+class TextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(object):
+    pass
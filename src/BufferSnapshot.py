@@ -0,0 +1,77 @@
+from bisect import bisect_right
+
+
+class BufferSnapshot(object):
+    """The text of a buffer at a given change count.
+
+    The snapshot also provides a line index, built the first time it is
+    needed, so rows and line text can be looked up without calls to the view.
+
+    """
+
+    def __init__(self, text, change_count):
+        super(BufferSnapshot, self).__init__()
+        self.text = text
+        self.change_count = change_count
+        self._line_starts = None
+
+    def __len__(self):
+        return len(self.text)
+
+    def apply_changes(self, changes, change_count):
+        """Returns a new snapshot with changes applied to the text.
+
+        Keyword arguments:
+        changes - a list of (begin, end, text) tuples, applied in order,
+            meaning the text from begin to end was replaced by text
+        change_count - the change count of the buffer after the changes
+
+        """
+        text = self.text
+        for begin, end, inserted in changes:
+            text = text[:begin] + inserted + text[end:]
+        return BufferSnapshot(text, change_count)
+
+    def substr(self, begin, end):
+        """Returns the text from begin to end."""
+        return self.text[begin:end]
+
+    @property
+    def line_starts(self):
+        """A list of the points at which each line begins."""
+        if self._line_starts is None:
+            text = self.text
+            starts = [0]
+            find = text.find
+            i = find('\n')
+            while i >= 0:
+                starts.append(i + 1)
+                i = find('\n', i + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def row(self, point):
+        """Returns the zero-based row containing point."""
+        return bisect_right(self.line_starts, point) - 1
+
+    def line(self, begin, end=None):
+        """Returns (begin, end) of the lines containing the given range.
+
+        The end of the last line does not include its newline character.
+
+        """
+        if end is None:
+            end = begin
+        starts = self.line_starts
+        line_begin = starts[bisect_right(starts, begin) - 1]
+        next_row = bisect_right(starts, end)
+        if next_row < len(starts):
+            line_end = starts[next_row] - 1
+        else:
+            line_end = len(self.text)
+        return line_begin, line_end
+
+    def line_text(self, begin, end=None):
+        """Returns the text of the lines containing the given range."""
+        line_begin, line_end = self.line(begin, end)
+        return self.text[line_begin:line_end]
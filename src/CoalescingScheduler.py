@@ -0,0 +1,82 @@
+import time
+
+import sublime
+
+
+class CoalescingScheduler(object):
+    """Collapses bursts of events for a view into a single callback.
+
+    Each call to schedule starts or extends a burst for the view. The
+    callback runs once the view has been quiet for quiet_period milliseconds,
+    or once max_latency milliseconds have passed since the burst started,
+    whichever comes first. Only the latest event of a burst is evaluated.
+
+    """
+
+    def __init__(self, callback, quiet_period=50, max_latency=250):
+        super(CoalescingScheduler, self).__init__()
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_latency = max_latency
+
+        # Latest event generation for each view, keyed by view ID
+        self._generations = dict()
+
+        # Time the current burst started for each view, keyed by view ID
+        self._burst_start = dict()
+
+    def schedule(self, view):
+        """Schedule the callback for the given view."""
+        view_id = view.id()
+        now = time.monotonic()
+        generation = self._generations.get(view_id, 0) + 1
+        self._generations[view_id] = generation
+        start = self._burst_start.setdefault(view_id, now)
+
+        remaining = self.max_latency - (now - start) * 1000
+        delay = max(0, min(self.quiet_period, remaining))
+        if delay <= 0:
+            self._fire(view, generation)
+        else:
+            sublime.set_timeout_async(
+                lambda: self._fire(view, generation), int(delay))
+
+    def cancel(self, view_id):
+        """Drop any pending evaluation and state for the given view ID."""
+        self._generations.pop(view_id, None)
+        self._burst_start.pop(view_id, None)
+
+    def is_current(self, view, generation, selection):
+        """Return True if the evaluation has not been overtaken.
+
+        An evaluation is overtaken when a newer event has been scheduled for
+        the view or the selection has changed since it started.
+
+        """
+        if self._generations.get(view.id()) != generation:
+            return False
+        return selection == self.selection_key(view)
+
+    @staticmethod
+    def selection_key(view):
+        """Return a hashable snapshot of the view's selection."""
+        return tuple((s.a, s.b) for s in view.sel())
+
+    def _fire(self, view, generation):
+        view_id = view.id()
+        start = self._burst_start.get(view_id)
+        if start is None:
+            # The burst has already been evaluated
+            return
+
+        latest = self._generations.get(view_id)
+        if ((generation != latest) and
+                ((time.monotonic() - start) * 1000 < self.max_latency)):
+            # A newer event will fire once the view is quiet
+            return
+
+        del self._burst_start[view_id]
+        selection = self.selection_key(view)
+        self.callback(
+            view,
+            is_stale=lambda: not self.is_current(view, latest, selection))
@@ -0,0 +1,127 @@
+import json
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .BufferSnapshot import BufferSnapshot
+from .ProjectIndex import ProjectIndex
+
+
+class DefinitionIndex(ProjectIndex):
+    """Index of the locations at which entities are defined in a project.
+
+    The pattern matches definitions. The entity name is taken from a group
+    named 'name' if the pattern has one, or from the whole match otherwise.
+    Each definition is stored as a 1-based (row, col) location, so a
+    definition can be found and opened without reading any files.
+
+    The index is saved as JSON to path, so it can be loaded when the editor
+    starts and then refreshed for the files modified since it was saved.
+
+    """
+
+    # Version of the format of saved indexes
+    FORMAT_VERSION = 2
+
+    def __init__(self, folders, pattern, file_patterns=('*',), path=None):
+        super(DefinitionIndex, self).__init__(folders, pattern,
+                                              file_patterns)
+        self.path = path
+
+    def scan_file(self, path):
+        """Returns (modification time, definitions) for a file.
+
+        definitions is a dictionary of lists of (row, col) tuples, keyed by
+        entity name. None is returned if the file cannot be read.
+
+        """
+        result = self.read_file(path)
+        if result is None:
+            return None
+        mtime, text = result
+        return mtime, self.scan_text(text)
+
+    def scan_text(self, text):
+        """Returns a dictionary of lists of (row, col) tuples for the
+        definitions in text, keyed by entity name.
+
+        """
+        group = 'name' if 'name' in self.pattern.groupindex else 0
+        snapshot = BufferSnapshot(text, None)
+        definitions = dict()
+        for match in self.pattern.finditer(text):
+            begin = match.start(group)
+            row = snapshot.row(begin)
+            definitions.setdefault(match.group(group), []).append(
+                (row + 1, begin - snapshot.line_starts[row] + 1))
+        return definitions
+
+    def definitions(self, name):
+        """Returns a sorted list of (path, row, col) tuples for each
+        definition of name.
+
+        """
+        with self._lock:
+            paths = self._occurrences.get(name, {})
+            result = [(path, row, col)
+                      for path, locations in paths.items()
+                      for row, col in locations]
+        result.sort()
+        return result
+
+    def header(self):
+        return {'version': self.FORMAT_VERSION,
+                'folders': list(self.folders),
+                'pattern': self.pattern.pattern,
+                'file_patterns': list(self.file_patterns)}
+
+    def load(self):
+        """Loads the index saved at path.
+
+        The saved index is ignored if it was saved for different folders or
+        patterns. Returns True if the index was loaded.
+
+        """
+        if self.path is None:
+            return False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get('header') != self.header():
+            return False
+
+        with self._lock:
+            self._files = dict()
+            self._occurrences = dict()
+            for path, (mtime, definitions) in data['files'].items():
+                self._store(path, mtime,
+                            dict((name, [tuple(l) for l in locations])
+                                 for name, locations in definitions.items()))
+        self.ready = True
+        return True
+
+    def save(self):
+        """Saves the index to path."""
+        if self.path is None:
+            return
+
+        with self._lock:
+            files = dict((path, [mtime, dict()])
+                         for mtime, names, path in self._files.values())
+            for name, paths in self._occurrences.items():
+                for path, locations in paths.items():
+                    files[path][1][name] = locations
+
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'header': self.header(), 'files': files}, f)
+            os.replace(temp_path, self.path)
+        except (IOError, OSError):
+            logger.exception('Unable to save definition index to %s',
+                             self.path)
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Size-bounded cache that evicts the least recently used entries.
+
+    Entries can also expire a fixed number of seconds after they are stored.
+    The numbers of hits and misses are counted so the cache size can be
+    tuned. The cache may be used from several threads.
+
+    """
+
+    # Returned by get for missing entries when no default is given
+    MISSING = object()
+
+    def __init__(self, max_size=128, ttl=None):
+        """
+        Keyword arguments:
+        max_size - the maximum number of entries to keep
+        ttl - the number of seconds after which an entry expires, or None if
+            entries do not expire
+
+        """
+        super(LRUCache, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not LRUCache.MISSING
+
+    def get(self, key, default=MISSING, count=True):
+        """Returns the value stored for key, or default if there is none.
+
+        Keyword arguments:
+        count - if True, the lookup is counted as a hit or miss
+
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                if (expires is None) or (expires > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+
+            if count:
+                self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Stores value for key, evicting the oldest entries if needed."""
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Removes the entries whose key matches predicate.
+
+        All entries are removed if predicate is None. Returns the number of
+        entries removed.
+
+        """
+        with self._lock:
+            if predicate is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [k for k in self._entries if predicate(k)]
+                for k in keys:
+                    del self._entries[k]
+                removed = len(keys)
+        return removed
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
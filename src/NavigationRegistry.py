@@ -0,0 +1,96 @@
+import threading
+import time
+
+import sublime
+
+
+class NavigationRegistry(object):
+    """Navigations waiting for a view to finish loading.
+
+    A navigation is a callback to be run with a view once it has loaded. The
+    registry is completed by calling view_loaded from an on_load listener,
+    so nothing waits on a thread while files load. Navigations expire after
+    a timeout, and are cancelled when the user activates another view in the
+    same window. Widgets such as the command palette, quick panels and the
+    console do not cancel navigations.
+
+    """
+
+    def __init__(self):
+        super(NavigationRegistry, self).__init__()
+        # (callback, deadline, window ID) tuples keyed by view ID
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, view, callback, timeout=10000):
+        """Run callback with view once the view has loaded.
+
+        Any navigation already waiting for the view is replaced.
+
+        Keyword arguments:
+        timeout - milliseconds after which the navigation is dropped
+
+        """
+        view_id = view.id()
+        deadline = time.monotonic() + timeout / 1000
+        window = view.window()
+        window_id = None if window is None else window.id()
+        with self._lock:
+            self._pending[view_id] = (callback, deadline, window_id)
+
+        # The view may have loaded before the navigation was registered
+        sublime.set_timeout_async(lambda: self._check_loaded(view), 0)
+        sublime.set_timeout_async(lambda: self._expire(view_id), timeout)
+
+    def _check_loaded(self, view):
+        if not view.is_loading():
+            self.view_loaded(view)
+
+    def _expire(self, view_id):
+        with self._lock:
+            try:
+                callback, deadline, window_id = self._pending[view_id]
+            except KeyError:
+                return
+            if deadline <= time.monotonic():
+                del self._pending[view_id]
+
+    def view_loaded(self, view):
+        """Run the navigation waiting for the view, if there is one."""
+        with self._lock:
+            try:
+                callback, deadline, window_id = self._pending.pop(view.id())
+            except KeyError:
+                return
+        if deadline > time.monotonic():
+            callback(view)
+
+    def view_activated(self, view):
+        """Cancel the navigations waiting for other views in the view's
+        window.
+
+        Nothing is cancelled when a widget is activated.
+
+        """
+        if view.settings().get('is_widget', False):
+            return
+        window = view.window()
+        if window is None:
+            return
+        window_id = window.id()
+        view_id = view.id()
+        with self._lock:
+            for key in [k for k, v in self._pending.items()
+                        if (v[2] == window_id) and (k != view_id)]:
+                del self._pending[key]
+
+    def cancel(self, view_id=None):
+        """Cancel the navigation waiting for a view, or all navigations."""
+        with self._lock:
+            if view_id is None:
+                self._pending.clear()
+            else:
+                self._pending.pop(view_id, None)
@@ -0,0 +1,91 @@
+import threading
+
+
+class PrefetchTask(object):
+    """A lookup started on a worker thread whose result may be needed early.
+
+    run is called by the worker. result returns the result of the lookup,
+    running it on the calling thread if the worker has not started it, for
+    example because the job was cancelled while queued. The caller is never
+    made to wait for the worker: while the worker is running the lookup,
+    result returns PENDING, and add_done_callback can be used to be told
+    when it completes. The lookup is never run twice unless the worker's
+    attempt raised an exception.
+
+    """
+
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+
+    # Returned by result while the worker is running the lookup
+    PENDING = object()
+
+    def __init__(self, key, lookup):
+        super(PrefetchTask, self).__init__()
+        self.key = key
+        self._lookup = lookup
+        self._state = PrefetchTask.QUEUED
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._failed = False
+
+    @property
+    def done(self):
+        """True if the lookup has completed without raising an exception."""
+        return (self._state == PrefetchTask.DONE) and not self._failed
+
+    def run(self):
+        """Runs the lookup unless another thread has already started it."""
+        with self._lock:
+            if self._state != PrefetchTask.QUEUED:
+                return
+            self._state = PrefetchTask.RUNNING
+        self._complete()
+
+    def result(self):
+        """Returns the result of the lookup, running it now if necessary.
+
+        PENDING is returned if the worker is running the lookup.
+
+        """
+        with self._lock:
+            state = self._state
+            if state == PrefetchTask.QUEUED:
+                self._state = PrefetchTask.RUNNING
+        if state == PrefetchTask.RUNNING:
+            return PrefetchTask.PENDING
+        elif state == PrefetchTask.QUEUED:
+            self._complete()
+        if self._failed:
+            return self._lookup()
+        return self._result
+
+    def add_done_callback(self, callback):
+        """Arranges for callback to be called when the worker's lookup ends.
+
+        callback is called without arguments on the worker thread, whether
+        or not the lookup raised an exception. Returns False, without
+        calling callback, if the worker is not running the lookup, in which
+        case result returns without waiting.
+
+        """
+        with self._lock:
+            if self._state != PrefetchTask.RUNNING:
+                return False
+            self._callbacks.append(callback)
+            return True
+
+    def _complete(self):
+        try:
+            self._result = self._lookup()
+        except Exception:
+            self._failed = True
+            raise
+        finally:
+            with self._lock:
+                self._state = PrefetchTask.DONE
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback()
@@ -0,0 +1,260 @@
+import fnmatch
+import os
+import re
+import threading
+
+from array import array
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ProjectIndex(object):
+    """Index of the entities found in the files of a project.
+
+    Each file in the project folders matching one of the file patterns is
+    searched for the entity pattern, and the beginning points of each match
+    are stored by matched text. Looking up the occurrences of an entity is
+    then a dictionary lookup, whatever the size of the project.
+
+    build scans all files, and refresh rescans only the files modified since
+    they were indexed. Both are meant to run on a worker thread, and can be
+    cancelled between files.
+    update_file rescans a single file, so the index can be kept up to date
+    as files are saved.
+
+    Files are keyed by their normalized path, so paths differing only in
+    case are the same file on case-insensitive systems, but lookups return
+    the paths as found on disk.
+
+    """
+
+    TYPECODE = 'q'
+
+    # Folders that are never indexed
+    EXCLUDED_FOLDERS = frozenset(('.git', '.hg', '.svn', '__pycache__',
+                                  'node_modules'))
+
+    # Files larger than this many bytes are not indexed
+    MAX_FILE_SIZE = 2 ** 20
+
+    # Files with a null byte in this many leading bytes are treated as
+    # binary and not indexed
+    BINARY_CHECK_SIZE = 8192
+
+    def __init__(self, folders, pattern, file_patterns):
+        super(ProjectIndex, self).__init__()
+        self.folders = tuple(os.path.abspath(f) for f in folders)
+        self._folder_keys = tuple(os.path.normcase(f) for f in self.folders)
+        self.pattern = re.compile(pattern)
+        self.file_patterns = tuple(file_patterns)
+        self.ready = False
+
+        # The modification time, matched texts and path of each file, keyed
+        # by normalized path
+        self._files = dict()
+
+        # The beginning points of each occurrence, keyed by matched text and
+        # then by path as found on disk
+        self._occurrences = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def includes(self, path):
+        """Returns True if path is a file that belongs in the index."""
+        if path is None:
+            return False
+        path = os.path.normcase(os.path.abspath(path))
+        for folder in self._folder_keys:
+            if path.startswith(folder + os.sep):
+                parts = os.path.relpath(path, folder).split(os.sep)
+                return (not self.EXCLUDED_FOLDERS.intersection(parts[:-1]) and
+                        self.matches_file_patterns(parts[-1]))
+        return False
+
+    def matches_file_patterns(self, file_name):
+        return any(fnmatch.fnmatch(file_name, p) for p in self.file_patterns)
+
+    def project_files(self):
+        """Yields the paths of the files in the project folders."""
+        for folder in self.folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [d for d in dirs if d not in self.EXCLUDED_FOLDERS]
+                for f in files:
+                    if self.matches_file_patterns(f):
+                        yield os.path.join(root, f)
+
+    def build(self, is_cancelled=None):
+        """Scans all files in the project and replaces the index contents.
+
+        Keyword arguments:
+        is_cancelled - a callable checked between files. The build stops,
+            leaving the index unchanged, if it returns True.
+
+        """
+        results = self.scan_files(list(self.project_files()), is_cancelled)
+        if results is None:
+            return False
+
+        with self._lock:
+            self._files = dict()
+            self._occurrences = dict()
+            for path, (mtime, occurrences) in results:
+                self._store(path, mtime, occurrences)
+        self.ready = True
+        return True
+
+    def refresh(self, is_cancelled=None):
+        """Rescans the files modified since they were indexed, and removes
+        the files that no longer exist.
+
+        Returns the number of files changed, or None if the refresh was
+        cancelled.
+
+        Keyword arguments:
+        is_cancelled - as for build
+
+        """
+        paths = dict((os.path.normcase(p), p) for p in self.project_files())
+        removed = [k for k in self._files if k not in paths]
+        changed = []
+        for key, path in paths.items():
+            indexed = self._files.get(key)
+            try:
+                if (indexed is None) or (indexed[0] != os.path.getmtime(path)):
+                    changed.append(path)
+            except OSError:
+                removed.append(key)
+
+        results = self.scan_files(changed, is_cancelled)
+        if results is None:
+            return None
+
+        with self._lock:
+            for key in removed:
+                self._discard(key)
+            for path, (mtime, occurrences) in results:
+                self._discard(os.path.normcase(path))
+                self._store(path, mtime, occurrences)
+        self.ready = True
+        return len(removed) + len(changed)
+
+    def scan_files(self, paths, is_cancelled=None):
+        """Scans files one after the other.
+
+        Returns a list of (path, scan_file result) tuples for the files that
+        could be read, or None if the scan was cancelled. is_cancelled is
+        checked before each file.
+
+        """
+        results = []
+        for path in paths:
+            if (is_cancelled is not None) and is_cancelled():
+                return None
+            result = self.scan_file(path)
+            if result is not None:
+                results.append((path, result))
+        return results
+
+    def read_file(self, path):
+        """Returns (modification time, text) for a file, or None if the
+        file is too large, binary or cannot be read.
+
+        """
+        try:
+            mtime = os.path.getmtime(path)
+            if os.path.getsize(path) > self.MAX_FILE_SIZE:
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            if b'\0' in data[:self.BINARY_CHECK_SIZE]:
+                return None
+            # Newlines are translated as when reading the file as text, so
+            # points match the ones used to display the occurrences
+            text = data.decode('utf-8', errors='replace')
+            return mtime, text.replace('\r\n', '\n').replace('\r', '\n')
+        except (IOError, OSError):
+            logger.debug('Unable to index %s', path)
+            return None
+
+    def scan_file(self, path):
+        """Returns (modification time, occurrences) for a file.
+
+        occurrences is a dictionary of arrays of beginning points, keyed by
+        matched text. None is returned if the file cannot be read.
+
+        """
+        result = self.read_file(path)
+        if result is None:
+            return None
+        mtime, text = result
+
+        occurrences = dict()
+        for match in self.pattern.finditer(text):
+            try:
+                occurrences[match.group()].append(match.start())
+            except KeyError:
+                occurrences[match.group()] = array(self.TYPECODE,
+                                                   (match.start(),))
+        return mtime, occurrences
+
+    def _store(self, path, mtime, occurrences):
+        key = os.path.normcase(path)
+        self._files[key] = (mtime, frozenset(occurrences), path)
+        for text, points in occurrences.items():
+            self._occurrences.setdefault(text, dict())[path] = points
+
+    def _discard(self, key):
+        try:
+            mtime, texts, path = self._files.pop(key)
+        except KeyError:
+            return
+        for text in texts:
+            paths = self._occurrences[text]
+            del paths[path]
+            if not paths:
+                del self._occurrences[text]
+
+    def update_file(self, path):
+        """Rescans a file if it has changed since it was indexed.
+
+        Files that no longer exist are removed from the index.
+
+        """
+        if not self.includes(path):
+            return
+        path = os.path.abspath(path)
+        key = os.path.normcase(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        else:
+            indexed = self._files.get(key)
+            if (indexed is not None) and (indexed[0] == mtime):
+                return
+
+        result = None if (mtime is None) else self.scan_file(path)
+        with self._lock:
+            self._discard(key)
+            if result is not None:
+                self._store(path, *result)
+
+    def occurrences(self, text):
+        """Returns a sorted list of (path, begin, end) tuples for each
+        occurrence of text in the project.
+
+        """
+        with self._lock:
+            paths = self._occurrences.get(text, {})
+            result = [(path, begin, begin + len(text))
+                      for path, points in paths.items()
+                      for begin in points]
+        result.sort()
+        return result
+
+    def entity_count(self):
+        """Returns the number of distinct entities in the index."""
+        return len(self._occurrences)
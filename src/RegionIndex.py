@@ -0,0 +1,317 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+import sublime
+
+
+class RegionIndex(object):
+    """Sorted collection of regions that answers containment queries.
+
+    Regions are stored as begin and end points in typed arrays, sorted by
+    their beginning and end points, along with the length of the longest
+    region. A region containing a point must begin within that length of
+    it, so containment checks are a bisect followed by a scan of the few
+    regions beginning just before the point. sublime.Region objects are only
+    created when regions are read, so large indexes take little memory.
+
+    The index can be used like a read-only list of regions. append and extend
+    are provided so existing code that builds region lists keeps working,
+    and apply_edit keeps the regions in step with edits to the buffer.
+
+    Edits do not shift the regions after them one by one. Instead, the
+    regions from a pivot index onwards have a pending offset added when they
+    are read, and an edit only adjusts the regions between the pivot and
+    the edit before moving the pivot there. Repeated edits in one place, as
+    when typing, therefore cost little more than copying the arrays.
+
+    Each change replaces the arrays as a whole, so a reader on another thread
+    always sees a consistent set of regions.
+
+    """
+
+    TYPECODE = 'q'
+
+    def __init__(self, regions=()):
+        super(RegionIndex, self).__init__()
+        self._set_pairs(RegionIndex.region_pairs(regions))
+
+    @staticmethod
+    def region_pairs(regions):
+        """Returns a sorted list of (begin, end) pairs for the regions."""
+        pairs = [(r.begin(), r.end()) for r in regions if r is not None]
+        pairs.sort()
+        return pairs
+
+    def _set_pairs(self, pairs):
+        """Replaces the stored regions with a sorted list of pairs."""
+        begins = array(self.TYPECODE, (p[0] for p in pairs))
+        ends = array(self.TYPECODE, (p[1] for p in pairs))
+        max_length = max([e - b for b, e in pairs] or [0])
+
+        # The arrays, the pivot index, the offset pending for the regions
+        # from the pivot onwards, and an upper bound on the region lengths
+        self._state = (begins, ends, len(begins), 0, max_length)
+
+    @staticmethod
+    def _shifted(values, offset):
+        """Returns an array of values with offset added, built in one step."""
+        if not offset:
+            return values
+        return array(RegionIndex.TYPECODE, map(offset.__add__, values))
+
+    def _pairs(self):
+        return list(zip(*self._points()))
+
+    def _points(self):
+        """Returns arrays of the begin and end points with the pending offset
+        applied.
+
+        """
+        begins, ends, pivot, offset, _ = self._state
+        return (begins[:pivot] + self._shifted(begins[pivot:], offset),
+                ends[:pivot] + self._shifted(ends[pivot:], offset))
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def __iter__(self):
+        Region = sublime.Region
+        return (Region(b, e) for b, e in zip(*self._points()))
+
+    def __getitem__(self, index):
+        state = self._state
+        if isinstance(index, slice):
+            return [self._region(state, i)
+                    for i in range(*index.indices(len(state[0])))]
+        if index < 0:
+            index += len(state[0])
+        if not 0 <= index < len(state[0]):
+            raise IndexError('RegionIndex index out of range')
+        return self._region(state, index)
+
+    @staticmethod
+    def _region(state, i):
+        begins, ends, pivot, offset, _ = state
+        if i < pivot:
+            return sublime.Region(begins[i], ends[i])
+        return sublime.Region(begins[i] + offset, ends[i] + offset)
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the arrays of the index."""
+        return sum(a.buffer_info()[1] * a.itemsize for a in self._state[:2])
+
+    def __repr__(self):
+        return 'RegionIndex({0!r})'.format(self._pairs())
+
+    @staticmethod
+    def _bisect(state, point, right=False):
+        """Bisects the begin points, with the pending offset applied."""
+        begins, ends, pivot, offset, _ = state
+        bisect = bisect_right if right else bisect_left
+        if pivot < len(begins):
+            first = begins[pivot] + offset
+            if (first < point) or (right and (first == point)):
+                return bisect(begins, point - offset, pivot)
+        return bisect(begins, point, 0, pivot)
+
+    def contains(self, x):
+        """Returns True if x is contained in any of the stored regions.
+
+        x may be a region or a point.
+
+        """
+        try:
+            begin, end = x.begin(), x.end()
+        except AttributeError:
+            begin = end = x
+        state = self._state
+        begins, ends, pivot, offset, max_length = state
+        lowest = end - max_length
+        i = self._bisect(state, begin, right=True) - 1
+        while i >= 0:
+            shift = offset if i >= pivot else 0
+            if begins[i] + shift < lowest:
+                break
+            if ends[i] + shift >= end:
+                return True
+            i -= 1
+        return False
+
+    @staticmethod
+    def intersects(lb, le, rb, re):
+        """Returns True if the ranges intersect, as sublime.Region does."""
+        return ((lb == rb and le == re) or (lb < rb < le) or
+                (lb < re < le) or (rb < lb < re) or (rb < le < re))
+
+    def first_intersecting(self, region):
+        """Returns the index of the first region intersecting the given
+        region, or None.
+
+        """
+        begin, end = region.begin(), region.end()
+        state = self._state
+        begins, ends, pivot, offset, max_length = state
+        lowest = begin - max_length
+        index = None
+        i = self._bisect(state, end, right=True) - 1
+        while i >= 0:
+            shift = offset if i >= pivot else 0
+            if begins[i] + shift < lowest:
+                break
+            if RegionIndex.intersects(begins[i] + shift, ends[i] + shift,
+                                      begin, end):
+                index = i
+            i -= 1
+        return index
+
+    def regions_beginning_within(self, begin, end):
+        """Returns a list of the regions beginning within the range from
+        begin to end.
+
+        """
+        state = self._state
+        return [self._region(state, i) for i in range(
+            self._bisect(state, begin), self._bisect(state, end, right=True))]
+
+    def next_after(self, point):
+        """Returns the first region beginning at or after point.
+
+        Wraps around to the first region if there is none. Returns None if
+        the index is empty.
+
+        """
+        state = self._state
+        if not state[0]:
+            return None
+        i = self._bisect(state, point)
+        if i >= len(state[0]):
+            i = 0
+        return self._region(state, i)
+
+    def previous_before(self, point):
+        """Returns the last region ending at or before point.
+
+        Wraps around to the last region if there is none. Returns None if
+        the index is empty.
+
+        """
+        state = self._state
+        begins, ends, pivot, offset, max_length = state
+        if not begins:
+            return None
+        lowest = point - max_length
+        i = self._bisect(state, point, right=True) - 1
+        while i >= 0:
+            shift = offset if i >= pivot else 0
+            if begins[i] + shift <= lowest:
+                # This and all earlier regions end at or before point
+                break
+            if ends[i] + shift <= point:
+                break
+            i -= 1
+        return self._region(state, i if i >= 0 else len(begins) - 1)
+
+    def append(self, region):
+        """Adds a region to the index."""
+        self.extend([region])
+
+    def extend(self, regions):
+        """Adds several regions to the index.
+
+        Regions which all fall between two stored regions are spliced in;
+        otherwise the index is sorted again.
+
+        """
+        pairs = RegionIndex.region_pairs(regions)
+        if not pairs:
+            return
+
+        state = self._state
+        start = self._bisect(state, pairs[0][0])
+        if start == self._bisect(state, pairs[-1][0], right=True):
+            self._splice(start, start, pairs, 0)
+        else:
+            pairs.extend(self._pairs())
+            pairs.sort()
+            self._set_pairs(pairs)
+
+    def clear(self):
+        """Removes all regions from the index."""
+        self._set_pairs([])
+
+    def _splice(self, start, stop, pairs, delta):
+        """Replaces the regions from index start to stop with a sorted list
+        of pairs, and shifts the regions after them by delta.
+
+        Only the regions between the pivot and the edit are adjusted here.
+        The regions after the edit keep the combined pending offset.
+
+        """
+        begins, ends, pivot, offset, max_length = self._state
+
+        def prefix(values):
+            if pivot >= start:
+                return values[:start]
+            return values[:pivot] + self._shifted(values[pivot:start], offset)
+
+        def suffix(values):
+            if pivot <= stop:
+                return values[stop:]
+            return self._shifted(values[stop:pivot], -offset) + values[pivot:]
+
+        new_begins = (prefix(begins) +
+                      array(self.TYPECODE, (p[0] for p in pairs)) +
+                      suffix(begins))
+        new_ends = (prefix(ends) +
+                    array(self.TYPECODE, (p[1] for p in pairs)) +
+                    suffix(ends))
+        if pairs:
+            max_length = max(max_length, max(e - b for b, e in pairs))
+        new_pivot = start + len(pairs)
+        new_offset = offset + delta
+        if (new_pivot == len(new_begins)) or not new_offset:
+            new_pivot, new_offset = len(new_begins), 0
+        self._state = (new_begins, new_ends, new_pivot, new_offset,
+                       max_length)
+
+    def _intersecting_slice(self, begin, end):
+        """Returns the (start, stop) indexes of the regions touching the
+        range from begin to end, assuming the regions do not overlap.
+
+        """
+        state = self._state
+        begins, ends, pivot, offset, _ = state
+        start = self._bisect(state, begin)
+        while (start > 0) and (ends[start - 1] +
+                               (offset if start - 1 >= pivot else 0) >= begin):
+            start -= 1
+        stop = self._bisect(state, end, right=True)
+        return start, stop
+
+    def remove_beginning_within(self, begin, end):
+        """Removes the regions beginning within the range from begin to end.
+
+        Returns the number of regions removed.
+
+        """
+        state = self._state
+        start = self._bisect(state, begin)
+        stop = self._bisect(state, end, right=True)
+        if start >= stop:
+            return 0
+        self._splice(start, stop, [], 0)
+        return stop - start
+
+    def apply_edit(self, begin, end, length):
+        """Adjusts the regions for text from begin to end being replaced by
+        length characters.
+
+        Regions touching the edited text are removed, and regions after it
+        are shifted by the change in length.
+
+        """
+        start, stop = self._intersecting_slice(begin, end)
+        delta = length - (end - begin)
+        if (start < stop) or delta:
+            self._splice(start, stop, [], delta)
@@ -0,0 +1,92 @@
+import re
+
+# Matches scope selectors that cannot be indexed by their last atom
+UNINDEXABLE_SELECTOR = re.compile(r'[()&]')
+
+# Splits a scope selector alternative into its positive and negated parts
+NEGATION = re.compile(r'\s-')
+
+
+class ScopeIndex(object):
+    """Maps scope selector atoms to the items that use them.
+
+    Each item is indexed by the last atom of every alternative in its scope
+    selector, since that atom has to match one of the scopes in a scope name
+    for the selector to score. Looking up a scope name then only returns the
+    items that could match it, in the order they were given to the index.
+
+    Items whose selectors use groups, intersections or leading negation are
+    returned for every scope name.
+
+    """
+
+    # Maximum number of scope names with cached candidates
+    MAX_CACHED_CANDIDATES = 1024
+
+    def __init__(self, items=()):
+        """Creates the index.
+
+        Keyword arguments:
+        items - An iterable of (item, selector) pairs in priority order. If
+            selector is None, the item is returned for every scope name.
+
+        """
+        super(ScopeIndex, self).__init__()
+        self._atoms = dict()
+        self._unindexed = []
+        self._priority = dict()
+        self._candidates = dict()
+
+        for item, selector in items:
+            self._priority[item] = len(self._priority)
+            atoms = ScopeIndex.selector_atoms(selector)
+            if atoms is None:
+                self._unindexed.append(item)
+            else:
+                for atom in atoms:
+                    self._atoms.setdefault(atom, []).append(item)
+
+    @staticmethod
+    def selector_atoms(selector):
+        """Returns the set of atoms a scope name must contain to match the
+        selector, or None if the selector cannot be indexed.
+
+        """
+        if (not selector) or UNINDEXABLE_SELECTOR.search(selector):
+            return None
+
+        atoms = set()
+        for alternative in re.split(r'[,|]', selector):
+            if alternative.lstrip().startswith('-'):
+                return None
+            path = NEGATION.split(alternative, 1)[0].split()
+            if path:
+                atoms.add(path[-1])
+        return atoms or None
+
+    def candidates(self, scope_name):
+        """Returns the items whose selectors may match the scope name.
+
+        The items are returned in priority order.
+
+        """
+        try:
+            return self._candidates[scope_name]
+        except KeyError:
+            pass
+
+        found = set(self._unindexed)
+        for scope in scope_name.split():
+            atom = ''
+            for part in scope.split('.'):
+                atom = (atom + '.' + part) if atom else part
+                try:
+                    found.update(self._atoms[atom])
+                except KeyError:
+                    pass
+
+        candidates = sorted(found, key=self._priority.__getitem__)
+        if len(self._candidates) >= ScopeIndex.MAX_CACHED_CANDIDATES:
+            self._candidates = dict()
+        self._candidates[scope_name] = candidates
+        return candidates
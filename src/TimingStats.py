@@ -0,0 +1,90 @@
+import threading
+
+from collections import deque
+
+
+class Timing(object):
+    """Call count and durations recorded for a single key.
+
+    The most recent SAMPLE_SIZE durations are kept to estimate percentiles.
+
+    """
+
+    SAMPLE_SIZE = 1024
+
+    def __init__(self):
+        super(Timing, self).__init__()
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = deque(maxlen=self.SAMPLE_SIZE)
+
+    def add(self, duration):
+        """Records a single call taking duration seconds."""
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum:
+            self.maximum = duration
+        self.samples.append(duration)
+
+    @property
+    def mean(self):
+        """Returns the mean duration in seconds."""
+        if self.count:
+            return self.total / self.count
+        return 0.0
+
+    def percentile(self, fraction):
+        """Returns the duration in seconds below which the given fraction of
+        the sampled calls completed.
+
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        index = int(round(fraction * len(samples))) - 1
+        return samples[min(len(samples) - 1, max(0, index))]
+
+
+class TimingStats(object):
+    """Collects Timing objects keyed by name.
+
+    Calls may be recorded from several threads.
+
+    """
+
+    def __init__(self):
+        super(TimingStats, self).__init__()
+        self.timings = dict()
+        self._lock = threading.Lock()
+
+    def record(self, key, duration):
+        """Records a call to key taking duration seconds."""
+        with self._lock:
+            try:
+                timing = self.timings[key]
+            except KeyError:
+                timing = self.timings[key] = Timing()
+            timing.add(duration)
+
+    def get(self, key):
+        """Returns the Timing for key, or None if nothing was recorded."""
+        return self.timings.get(key)
+
+    def items(self):
+        """Returns (key, Timing) pairs sorted by descending total duration."""
+        with self._lock:
+            items = list(self.timings.items())
+        return sorted(items, key=lambda i: i[1].total, reverse=True)
+
+    def reset(self):
+        """Discards all recorded timings."""
+        with self._lock:
+            self.timings = dict()
+
+    def take(self):
+        """Returns the items, sorted as by items, and discards them."""
+        with self._lock:
+            items = list(self.timings.items())
+            self.timings = dict()
+        return sorted(items, key=lambda i: i[1].total, reverse=True)
@@ -0,0 +1,136 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+import sublime
+
+
+class Cancelled(Exception):
+    """Raised by a job that stops because its token was cancelled."""
+    pass
+
+
+class CancellationToken(object):
+    """Flag shared between a job and the code that submitted it."""
+
+    def __init__(self):
+        super(CancellationToken, self).__init__()
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Ask the job to stop. Its result will not be delivered."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raise Cancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class WorkerPool(object):
+    """Runs jobs on a dedicated pool of worker threads.
+
+    Each job is submitted with a key, and only the latest job for a key is
+    current: submitting a new job cancels the token of the previous one. The
+    result of a job that completes without being cancelled is passed to its
+    callback on Sublime's async thread.
+
+    """
+
+    # Token of the job running on the current thread
+    _local = threading.local()
+
+    def __init__(self, max_workers=2, name='WorkerPool'):
+        super(WorkerPool, self).__init__()
+        self.max_workers = max_workers
+        self.name = name
+        self._executor = None
+        self._tokens = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_token():
+        """Return the token of the job running on this thread, or None."""
+        return getattr(WorkerPool._local, 'token', None)
+
+    def submit(self, key, job, on_done=None):
+        """Run job() on a worker thread.
+
+        Any previous job submitted with the same key is cancelled. If the job
+        completes and is still current, on_done is called with its result on
+        the async thread.
+
+        Returns the CancellationToken of the job.
+
+        """
+        token = CancellationToken()
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            executor = self._executor
+        if previous is not None:
+            previous.cancel()
+
+        executor.submit(self._run, key, token, job, on_done)
+        return token
+
+    def cancel(self, key):
+        """Cancel the current job for the key, if there is one."""
+        with self._lock:
+            token = self._tokens.pop(key, None)
+        if token is not None:
+            token.cancel()
+
+    def is_current(self, key, token):
+        """Return True if token belongs to the current job for the key."""
+        return (not token.cancelled) and (self._tokens.get(key) is token)
+
+    def shutdown(self):
+        """Cancel all jobs and stop the worker threads."""
+        with self._lock:
+            tokens = list(self._tokens.values())
+            self._tokens = dict()
+            executor = self._executor
+            self._executor = None
+        for token in tokens:
+            token.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _run(self, key, token, job, on_done):
+        if token.cancelled:
+            return
+
+        WorkerPool._local.token = token
+        try:
+            result = job()
+        except Cancelled:
+            return
+        except Exception:
+            logger.exception('Error occurred in %s job for %s',
+                             self.name, key)
+            return
+        finally:
+            WorkerPool._local.token = None
+
+        if token.cancelled:
+            return
+        sublime.set_timeout_async(
+            lambda: self._complete(key, token, on_done, result), 0)
+
+    def _complete(self, key, token, on_done, result):
+        with self._lock:
+            if not self.is_current(key, token):
+                return
+            del self._tokens[key]
+        if on_done is not None:
+            on_done(result)
@@ -0,0 +1,127 @@
+"""Tests for the edit handling of RegionIndex.
+
+The tests run against the stand-in sublime module used by the benchmarks.
+
+"""
+import os
+import random
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'benchmarks'))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'src'))
+
+import sublime
+from RegionIndex import RegionIndex
+
+
+def pairs(index):
+    return [(r.begin(), r.end()) for r in index]
+
+
+def apply_edit_to_pairs(regions, begin, end, length):
+    """Reference implementation of RegionIndex.apply_edit."""
+    delta = length - (end - begin)
+    result = []
+    for b, e in regions:
+        if e < begin:
+            result.append((b, e))
+        elif b > end:
+            result.append((b + delta, e + delta))
+    return result
+
+
+class TestRegionIndexEdits(unittest.TestCase):
+
+    def make_index(self, regions):
+        return RegionIndex([sublime.Region(b, e) for b, e in regions])
+
+    def test_edit_shifts_later_regions(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23)])
+        index.apply_edit(5, 5, 4)
+        self.assertEqual(pairs(index), [(0, 3), (14, 17), (24, 27)])
+
+    def test_edit_removes_touching_regions(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23)])
+        index.apply_edit(12, 15, 0)
+        self.assertEqual(pairs(index), [(0, 3), (17, 20)])
+
+    def test_edit_touching_region_end_removes_it(self):
+        index = self.make_index([(0, 3), (10, 13)])
+        index.apply_edit(3, 3, 2)
+        self.assertEqual(pairs(index), [(12, 15)])
+
+    def test_pending_offset_is_applied_on_read(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23), (30, 33)])
+        index.apply_edit(5, 5, 2)
+        index.apply_edit(6, 6, 3)
+        self.assertEqual(len(index), 4)
+        self.assertEqual((index[2].begin(), index[2].end()), (25, 28))
+        self.assertEqual((index[-1].begin(), index[-1].end()), (35, 38))
+        self.assertEqual([(r.begin(), r.end()) for r in index[1:3]],
+                         [(15, 18), (25, 28)])
+
+    def test_pivot_moves_back_for_earlier_edit(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23), (30, 33)])
+        index.apply_edit(25, 25, 5)
+        index.apply_edit(5, 7, 0)
+        self.assertEqual(pairs(index), [(0, 3), (8, 11), (18, 21), (33, 36)])
+
+    def test_pivot_moves_forward_for_later_edit(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23), (30, 33)])
+        index.apply_edit(5, 5, 5)
+        index.apply_edit(29, 29, 1)
+        self.assertEqual(pairs(index), [(0, 3), (15, 18), (25, 28), (36, 39)])
+
+    def test_edits_cancelling_out_clear_the_offset(self):
+        index = self.make_index([(0, 3), (10, 13)])
+        index.apply_edit(5, 5, 3)
+        index.apply_edit(5, 8, 0)
+        self.assertEqual(pairs(index), [(0, 3), (10, 13)])
+
+    def test_queries_use_pending_offset(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23)])
+        index.apply_edit(5, 5, 4)
+        self.assertTrue(index.contains(15))
+        self.assertFalse(index.contains(11))
+        self.assertTrue(index.contains(sublime.Region(24, 27)))
+        self.assertEqual(index.next_after(5).begin(), 14)
+        self.assertEqual(index.previous_before(20).begin(), 14)
+        self.assertEqual(index.first_intersecting(sublime.Region(15, 25)), 1)
+        self.assertEqual(
+            [r.begin() for r in index.regions_beginning_within(4, 24)],
+            [14, 24])
+
+    def test_extend_and_remove_after_edit(self):
+        index = self.make_index([(0, 3), (10, 13), (20, 23)])
+        index.apply_edit(5, 5, 4)
+        index.extend([sublime.Region(5, 8)])
+        self.assertEqual(pairs(index), [(0, 3), (5, 8), (14, 17), (24, 27)])
+        self.assertEqual(index.remove_beginning_within(5, 14), 2)
+        self.assertEqual(pairs(index), [(0, 3), (24, 27)])
+
+    def test_random_edits_match_reference(self):
+        rng = random.Random(0)
+        for trial in range(50):
+            regions = []
+            point = 0
+            for i in range(rng.randint(0, 40)):
+                point += rng.randint(1, 10)
+                length = rng.randint(0, 5)
+                regions.append((point, point + length))
+                point += length
+            index = self.make_index(regions)
+            for edit in range(30):
+                begin = rng.randint(0, point + 10)
+                end = begin + rng.choice((0, 0, rng.randint(0, 8)))
+                length = rng.randint(0, 8)
+                index.apply_edit(begin, end, length)
+                regions = apply_edit_to_pairs(regions, begin, end, length)
+                point += length - (end - begin)
+                self.assertEqual(pairs(index), regions)
+                self.assertEqual(len(index), len(regions))
+
+
+if __name__ == '__main__':
+    unittest.main()